@@ -2,6 +2,11 @@
 """
 
 import functools
+import hashlib
+import hmac
+import logging
+import os
+import time
 import flask
 import redis
 import uuid
@@ -10,27 +15,195 @@ from . import config
 
 config = config.get_config()
 
+logger = logging.getLogger(__name__)
+
+SECRET = os.environ.get('SOFTWARE_REGISTRY_AUTH_SECRET', config['AUTH']['SECRET'] or '').encode()
+
+# placeholders of the shipped configs, anybody could sign keys with them.
+UNSAFE_SECRETS = (b'', b'change-me')
+
+
+# KEYS: client keys sorted set
+# ARGV: client key, ttl
+# Returns: 1 if the client key is valid, expired keys are removed.
+VALIDATE_CLIENT_KEY = """
+local creation_time = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not creation_time then
+    return 0
+end
+
+local current_time = tonumber(redis.call('TIME')[1])
+if current_time - tonumber(creation_time) < tonumber(ARGV[2]) then
+    return 1
+end
+
+redis.call('ZREM', KEYS[1], ARGV[1])
+return 0
+"""
+
+
+_redis = {'pid': None, 'client': None, 'validate': None}
+
+_revoked = {'expires': 0, 'keys': frozenset()}
+
+
+def get_redis():
+    """ Redis client sharing the connection pool of the process.
+        Pool is created again in a forked process (e.g. a gunicorn worker)
+        so that connections are never shared between processes.
+
+        Returns:
+            tuple: redis client and the registered validation script.
+    """
+    if _redis['pid'] != os.getpid():
+        pool = redis.ConnectionPool.from_url(config['REDIS_URIS']['app'])
+        client = redis.StrictRedis(connection_pool=pool)
+        _redis.update(
+            pid=os.getpid(),
+            client=client,
+            validate=client.register_script(VALIDATE_CLIENT_KEY)
+        )
+
+    return _redis['client'], _redis['validate']
+
+
+def _key(*parts):
+    return config['CACHE']['DELIMITER'].join([config['CACHE']['KEY'], 'client'] + list(parts))
+
+
+def _sign(payload):
+    return hmac.new(SECRET, payload.encode(), hashlib.sha256).hexdigest().encode()
+
+
+def check_config():
+    """ Check the auth config once when the app starts,
+        rather than failing every request issuing a client key.
+
+        Raises:
+            RuntimeError: if signed keys are set up without a secret.
+    """
+    if config['AUTH']['MODE'] == 'signed' and SECRET in UNSAFE_SECRETS:
+        raise RuntimeError('Signed client keys need SOFTWARE_REGISTRY_AUTH_SECRET to be set.')
+
 
 def add_client_key():
-    """ Add client key to the database (memory).
+    """ Add client key to the database (memory),
+        or issue a signed one when the auth mode is signed.
 
         Retuns:
             str: client key's value.
     """
-    redis_server = redis.StrictRedis.from_url(config['REDIS_URIS']['app'])
+    if config['AUTH']['MODE'] == 'signed':
+        return issue_signed_key()
 
-    key = config['CACHE']['DELIMITER'].join([
-        config['CACHE']['KEY'],
-        'client',
-    ])
+    redis_server, _ = get_redis()
+
+    key = _key()
     name = uuid.uuid4().hex
     value = float(redis_server.time()[0])
     redis_server.zadd(key, value, name)
     return name
 
 
-def validate_client_key(client_key, ttl=86400):
-    """ Validate the given client key.
+def issue_signed_key():
+    """ Issue a client key signed with the secret, carrying its issue time.
+        It is verified without any storage.
+
+        Returns:
+            str: client key's value i.e. issue time, nonce and signature.
+
+        Raises:
+            RuntimeError: if the secret is not set.
+    """
+    if SECRET in UNSAFE_SECRETS:
+        raise RuntimeError('Signed client keys need SOFTWARE_REGISTRY_AUTH_SECRET to be set.')
+
+    payload = '{}.{}'.format(int(time.time()), uuid.uuid4().hex)
+    return '{}.{}'.format(payload, _sign(payload).decode())
+
+
+def verify_signed_key(client_key, ttl):
+    """ Verify the signature and the age of the signed client key, locally.
+
+        Args:
+            client_key (str): signed key needs to be verified.
+            ttl (int): time to live for the key in seconds.
+
+        Returns:
+            bool: verification result for the key.
+    """
+    if SECRET in UNSAFE_SECRETS:
+        logger.error('Signed client keys are refused, SOFTWARE_REGISTRY_AUTH_SECRET is not set.')
+        return False
+
+    try:
+        issued, nonce, signature = client_key.split('.')
+        age = time.time() - int(issued)
+    except ValueError:
+        return False
+
+    # bytes, as compare_digest refuses non ascii strings.
+    if not hmac.compare_digest(signature.encode(), _sign('{}.{}'.format(issued, nonce))):
+        return False
+
+    return 0 <= age < ttl and not is_revoked(nonce, ttl)
+
+
+def is_revoked(nonce, ttl):
+    """ Check if the signed key is revoked.
+        Revoked keys are read again from redis once their local copy expires,
+        the stale copy is used while redis is unavailable.
+
+        Args:
+            nonce (str): nonce of the signed key.
+            ttl (int): time to live for the keys in seconds.
+
+        Returns:
+            bool: True if the key is revoked.
+    """
+    if _revoked['expires'] < time.time():
+        try:
+            redis_server, _ = get_redis()
+            # revocations older than the key ttl are of expired keys.
+            keys = redis_server.zrangebyscore(_key('revoked'), time.time() - ttl, '+inf')
+            _revoked['keys'] = frozenset(
+                key.decode() if isinstance(key, bytes) else key
+                for key in keys
+            )
+        except redis.RedisError:
+            logger.error('Revoked client keys could not be read.', exc_info=True)
+
+        _revoked['expires'] = time.time() + config['AUTH']['REVOCATION_CACHE_TTL']
+
+    return bool(_revoked['keys']) and nonce in _revoked['keys']
+
+
+def revoke_client_key(client_key):
+    """ Revoke the client key before it expires.
+
+        Args:
+            client_key (str): key needs to be revoked.
+    """
+    redis_server, _ = get_redis()
+
+    parts = client_key.split('.')
+    if len(parts) != 3:
+        redis_server.zrem(_key(), client_key)
+        return
+
+    ttl = config['AUTH']['TTL']
+    now = time.time()
+    with redis_server.pipeline() as pipe:
+        pipe.zadd(_key('revoked'), now, parts[1])
+        pipe.zremrangebyscore(_key('revoked'), '-inf', now - ttl)
+        pipe.execute()
+
+    _revoked['expires'] = 0
+
+
+def validate_client_key(client_key, ttl=None):
+    """ Validate the given client key, a signed one locally
+        and a stored one in a single round trip.
 
         Args:
             client_key (str): key needs to be validated.
@@ -41,23 +214,15 @@ def validate_client_key(client_key, ttl=86400):
         Returns:
             bool: validation result for the key.
     """
-    redis_server = redis.StrictRedis.from_url(config['REDIS_URIS']['app'])
-    key = config['CACHE']['DELIMITER'].join([
-        config['CACHE']['KEY'],
-        'client'
-    ])
-
-    creation_time = redis_server.zscore(key, client_key)
-    if creation_time is None:
-        return False
+    ttl = ttl or config['AUTH']['TTL']
 
-    current_time = redis_server.time()[0]
+    # stored keys (uuid) are still accepted after switching to signed ones.
+    if config['AUTH']['MODE'] == 'signed' and '.' in client_key:
+        return verify_signed_key(client_key, ttl)
 
-    if current_time - creation_time < ttl:
-        return True
+    _, validate = get_redis()
 
-    redis_server.zrem(key, client_key)
-    return False
+    return bool(validate(keys=[_key()], args=[client_key, ttl]))
 
 
 def validate_client(func):
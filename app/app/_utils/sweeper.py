@@ -0,0 +1,111 @@
+""" Module for the background sweeper of the expired client keys.
+"""
+
+import logging
+import threading
+import time
+from . import auth
+
+
+config = auth.config
+
+logger = logging.getLogger(__name__)
+
+
+# KEYS: client keys sorted set
+# ARGV: expiry score, chunk size
+# Returns: number of removed keys, at most chunk size.
+SWEEP_CHUNK = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+if #expired == 0 then
+    return 0
+end
+
+-- the expired keys are the lowest ranked ones, ties included
+return redis.call('ZREMRANGEBYRANK', KEYS[1], 0, #expired - 1)
+"""
+
+
+def sweep():
+    """ Remove the expired client keys in bounded chunks,
+        at most once per interval across all the app processes, and record the metrics.
+
+        Returns:
+            dict: metrics of the sweep or None if another process is sweeping.
+    """
+    sweep_config = config['AUTH']['SWEEP']
+    redis_server, _ = auth.get_redis()
+
+    # the lock is left to expire so that the next sweep waits for the interval.
+    if not redis_server.set(auth._key('sweep'), 1, nx=True, ex=sweep_config['INTERVAL']):
+        return None
+
+    start = time.time()
+    swept = 0
+    sweep_chunk = redis_server.register_script(SWEEP_CHUNK)
+    expiry = redis_server.time()[0] - config['AUTH']['TTL']
+
+    while True:
+        removed = sweep_chunk(keys=[auth._key()], args=[expiry, sweep_config['CHUNK']])
+        swept += removed
+        if removed < sweep_config['CHUNK']:
+            break
+        # let the requests in between the chunks.
+        time.sleep(sweep_config['PAUSE'])
+
+    metrics = {
+        'size': redis_server.zcard(auth._key()),
+        'swept': swept,
+        'duration': time.time() - start,
+        'last_sweep': start,
+    }
+    redis_server.hmset(auth._key('metrics'), metrics)
+
+    logger.info('Client keys({}) swept in {:.3f}s, {} left.'.format(swept, metrics['duration'], metrics['size']))
+
+    return metrics
+
+
+def get_metrics():
+    """ Metrics of the last sweep and current size of the client keys.
+
+        Returns:
+            dict: size, swept keys, duration and time of the last sweep.
+    """
+    redis_server, _ = auth.get_redis()
+
+    with redis_server.pipeline() as pipe:
+        pipe.hgetall(auth._key('metrics'))
+        pipe.zcard(auth._key())
+        metrics, size = pipe.execute()
+
+    metrics = {
+        (key.decode() if isinstance(key, bytes) else key): float(value)
+        for key, value in metrics.items()
+    }
+    metrics['size'] = size
+
+    return metrics
+
+
+def run():
+    """ Sweep the expired client keys forever.
+    """
+    while True:
+        try:
+            sweep()
+        except Exception:
+            logger.error('Exception occurred while sweeping client keys.', exc_info=True)
+
+        time.sleep(config['AUTH']['SWEEP']['INTERVAL'])
+
+
+def start():
+    """ Start the sweeper in a background thread of the current process.
+
+        Returns:
+            Thread: sweeper thread.
+    """
+    thread = threading.Thread(target=run, name='client-key-sweeper', daemon=True)
+    thread.start()
+    return thread
@@ -2,11 +2,13 @@
 and providing all the api entrypoints and rendering templates.
 """
 
+import base64
 import functools
+import json
 import flask
 import flask_nameko
 from urllib import parse
-from _utils import config, auth
+from _utils import config, auth, sweeper
 
 config = config.get_config()
 
@@ -17,6 +19,12 @@ app.config['NAMEKO_AMQP_URI'] = config['NAMEKO_AMQP_URI']
 
 rpc.init_app(app)
 
+# refuse to start with a broken auth config, instead of failing the requests.
+auth.check_config()
+
+# started in every worker process, sweeps are shared through a lock in redis.
+sweeper.start()
+
 # TODO: use Blueprint for different routes
 
 
@@ -38,6 +46,93 @@ def resource_not_found(category, resource):
     )
 
 
+def invalid_parameter(message):
+    """ Custom 422 error handler for a malformed query parameter.
+    """
+    response = {
+        'error': 'invalid parameter',
+        'message': message,
+    }
+    return flask.make_response(
+        flask.jsonify(response),
+        422,
+        {}
+    )
+
+
+def encode_cursor(repo):
+    """ Opaque cursor pointing after the given repository.
+
+        Args:
+            repo (dict): last repository of the page.
+
+        Returns:
+            str: url safe cursor.
+    """
+    position = json.dumps([repo['downloads'] or 0, repo['name']])
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """ Decode the cursor returned with the previous page.
+
+        Args:
+            cursor (str): url safe cursor.
+
+        Returns:
+            list: downloads and name of the last repository of the previous page.
+
+        Raises:
+            ValueError: if the cursor is malformed.
+    """
+    try:
+        downloads, name = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except Exception:
+        raise ValueError('Malformed cursor({}).'.format(cursor))
+
+    if not isinstance(downloads, int) or not isinstance(name, str):
+        raise ValueError('Malformed cursor({}).'.format(cursor))
+
+    return [downloads, name]
+
+
+def limit_param():
+    """ Get the page size from the request arguments.
+
+        Returns:
+            int: limit, the default one if not given.
+
+        Raises:
+            ValueError: if it is malformed.
+    """
+    pagination = config['PAGINATION']
+    limit = flask.request.args.get('limit', pagination['DEFAULT_LIMIT'], type=int)
+    if not limit or not 0 < limit <= pagination['MAX_LIMIT']:
+        raise ValueError(
+            'Limit parameter should be a number between 1 and {}.'.format(pagination['MAX_LIMIT'])
+        )
+
+    return limit
+
+
+def page_params():
+    """ Get the page size and cursor from the request arguments.
+
+        Returns:
+            tuple: limit and decoded cursor (None for the first page).
+
+        Raises:
+            ValueError: if any of them is malformed.
+    """
+    limit = limit_param()
+
+    cursor = flask.request.args.get('cursor')
+    if cursor:
+        cursor = decode_cursor(cursor)
+
+    return limit, cursor or None
+
+
 def client_key_from_cookie(func):
     """ Decorator to get client key from cookie.
 
@@ -83,7 +178,7 @@ def index(client_key=None):
     if not client_key:
         client_key = auth.add_client_key()
 
-    tags = [name for name, _ in rpc.registry.get_tags()]
+    tags = [name for name, _ in rpc.registry.get_tags(None, config['TAGS']['INDEX_LIMIT'])]
 
     response = flask.make_response(
         flask.render_template('index.html', tags=tags, repos=[])
@@ -111,11 +206,27 @@ def get_repo_cards(client_key=None):
         client_key = auth.add_client_key()
 
     tags = flask.request.args.getlist('tag')
+    query = flask.request.args.get('q', '').strip()
 
-    repos = rpc.registry.get_repos(tags)
+    try:
+        limit, cursor = page_params()
+    except ValueError as e:
+        return invalid_parameter(str(e))
+
+    next_url = None
+    if query:
+        repos = rpc.registry.search_repos(query, limit)
+    else:
+        repos = rpc.registry.get_repos(tags, 'any', limit, cursor)
+
+        # a full page may be followed by another one, loaded on demand by the ui.
+        if len(repos) == limit:
+            args = flask.request.args.to_dict(flat=False)
+            args['cursor'] = encode_cursor(repos[-1])
+            next_url = '{}?{}'.format(flask.url_for('get_repo_cards'), parse.urlencode(args, doseq=True))
 
     response = flask.make_response(
-        flask.render_template('repo_cards.html', repos=repos)
+        flask.render_template('repo_cards.html', repos=repos, next_url=next_url)
     )
 
     response.set_cookie('software-registry-client-key', client_key)
@@ -131,7 +242,7 @@ def api_home():
             Response object: with all the categories of resources.
     """
     api_home_url = flask.url_for('api_home')
-    resources = ['repos', 'tags']
+    resources = ['repos', 'tags', 'search']
     response = {
         '{}_url'.format(resource): '{}/{}'.format(api_home_url, resource)
         for resource in resources
@@ -154,6 +265,39 @@ def tags():
         return add_tag()
 
 
+@app.route('/api/tags/complete', methods=['GET'])
+@auth.validate_client
+def complete_tags():
+    """ Entrypoint to complete the tag names starting with a prefix.
+
+        Returns:
+            Response object: json response with the most popular matching tags.
+    """
+    prefix = flask.request.args.get('prefix', '').strip()
+    if not prefix:
+        return invalid_parameter(
+            'No prefix provided. Use the prefix parameter e.g. {}?prefix=us'.format(flask.url_for('complete_tags'))
+        )
+
+    complete = config['TAGS']['COMPLETE']
+    limit = flask.request.args.get('limit', complete['DEFAULT_LIMIT'], type=int)
+    if not limit or not 0 < limit <= complete['MAX_LIMIT']:
+        return invalid_parameter(
+            'Limit parameter should be a number between 1 and {}.'.format(complete['MAX_LIMIT'])
+        )
+
+    tags = rpc.registry.complete_tags(prefix, limit)
+
+    response = {
+        'tag_details': tags,
+        'tag_urls': {
+            name: parse.quote('/'.join([flask.url_for('tags'), name]))
+            for name, popularity in tags
+        }
+    }
+    return flask.jsonify(response)
+
+
 @app.route('/api/tags/<path:tag>', methods=['GET'])
 @auth.validate_client
 def get_tag(tag):
@@ -203,6 +347,65 @@ def get_repo(repo):
         return update_downloads(repo)
 
 
+@app.route('/api/search', methods=['GET'])
+@auth.validate_client
+def search():
+    """ Entrypoint to search the repositories by name and description.
+
+        Returns:
+            Response object: json response with the best matching repositories.
+    """
+    query = flask.request.args.get('q', '').strip()
+    if not query:
+        return invalid_parameter(
+            'No query provided. Use the q parameter e.g. {}?q=usd'.format(flask.url_for('search'))
+        )
+
+    try:
+        limit = limit_param()
+    except ValueError as e:
+        return invalid_parameter(str(e))
+
+    repos = rpc.registry.search_repos(query, limit)
+
+    response = {
+        'repo_details': repos,
+        'repo_urls': {
+            repo['name']: parse.quote('/'.join([flask.url_for('repos'), repo['name']]))
+            for repo in repos
+        }
+    }
+    return flask.jsonify(response)
+
+
+@app.route('/api/auth/metrics', methods=['GET'])
+@auth.validate_client
+def client_key_metrics():
+    """ Entrypoint to get the metrics of the client keys.
+
+        Returns:
+            Response object: json response with the size of the client keys
+                             and the metrics of the last sweep.
+    """
+    return flask.jsonify(sweeper.get_metrics())
+
+
+@app.route('/api/auth/client-key', methods=['DELETE'])
+@auth.validate_client
+def revoke_client_key():
+    """ Entrypoint to revoke the client key before it expires.
+
+        Returns:
+            Response object: json response for the operation.
+    """
+    auth.revoke_client_key(flask.request.args.get('client-key'))
+    response = {
+        'message': 'Client key has been revoked.',
+        'client_key_url': '{}/auth/client-key'.format(flask.url_for('api_home'))
+    }
+    return flask.jsonify(response)
+
+
 @app.route('/api/auth/client-key', methods=['POST'])
 def generate_client_key():
     """ Entrypoint to generate the client key.
@@ -265,12 +468,18 @@ def add_tag():
 
 
 def get_tags():
-    """ Function to fetch tags from registry.
+    """ Function to fetch tags from registry, all of them or the named ones.
 
         Returns:
             Response object: json response with all urls for the fetched tags.
     """
-    tags = rpc.registry.get_tags()
+    names = flask.request.args.getlist('name')
+    if len(names) > config['PAGINATION']['MAX_LIMIT']:
+        return invalid_parameter(
+            'At most {} names can be given at once.'.format(config['PAGINATION']['MAX_LIMIT'])
+        )
+
+    tags = rpc.registry.get_tags(names or None)
 
     tag_urls = {
         name: parse.quote('/'.join([flask.url_for('tags'), name]))
@@ -282,6 +491,12 @@ def get_tags():
         'tag_urls': tag_urls
     }
 
+    if names:
+        found = set(tag_urls)
+        response['not_found'] = [name for name in names if name not in found]
+    else:
+        response['tag_names_query_example'] = '{}?name=tag1&name=tag2'.format(flask.url_for('tags'))
+
     return flask.jsonify(response)
 
 
@@ -343,9 +558,21 @@ def get_repos():
         Returns:
             Response object: json response with all urls for the fetched repositories.
     """
+    if 'name' in flask.request.args:
+        return get_repos_by_name()
+
     tags = flask.request.args.getlist('tag')
+    match = flask.request.args.get('match', 'any')
 
-    repos = rpc.registry.get_repos(tags)
+    if match not in ('any', 'all'):
+        return invalid_parameter('Match parameter should be either "any" or "all" of the tags.')
+
+    try:
+        limit, cursor = page_params()
+    except ValueError as e:
+        return invalid_parameter(str(e))
+
+    repos = rpc.registry.get_repos(tags, match, limit, cursor)
 
     repo_urls = {
         repo['name']: parse.quote('/'.join([flask.url_for('repos'), repo['name']]))
@@ -354,11 +581,49 @@ def get_repos():
 
     response = {
         'repo_details': repos,
-        'repo_urls': repo_urls
+        'repo_urls': repo_urls,
+        'next_cursor': None
     }
+
+    # a full page may be followed by another one.
+    if len(repos) == limit:
+        args = flask.request.args.to_dict(flat=False)
+        args['cursor'] = encode_cursor(repos[-1])
+        response['next_cursor'] = args['cursor']
+        response['next_url'] = '{}?{}'.format(flask.url_for('repos'), parse.urlencode(args, doseq=True))
+
     if not tags:
         response['repo_query_example'] = '{}?tag=tag1&tag=tag2'.format(flask.url_for('repos'))
+        response['repo_all_tags_query_example'] = '{}?tag=tag1&tag=tag2&match=all'.format(flask.url_for('repos'))
+        response['repo_page_query_example'] = '{}?tag=tag1&limit=20&cursor=xxxxx'.format(flask.url_for('repos'))
+        response['repo_names_query_example'] = '{}?name=repo1&name=repo2'.format(flask.url_for('repos'))
+
+    return flask.jsonify(response)
+
+
+def get_repos_by_name():
+    """ Function to fetch the named repositories from registry in one call.
+
+        Returns:
+            Response object: json response with the repositories in the order
+                             of the names and the names not found.
+    """
+    names = flask.request.args.getlist('name')
+    if len(names) > config['PAGINATION']['MAX_LIMIT']:
+        return invalid_parameter(
+            'At most {} names can be given at once.'.format(config['PAGINATION']['MAX_LIMIT'])
+        )
 
+    result = rpc.registry.get_repos_by_name(names)
+
+    response = {
+        'repo_details': result['repos'],
+        'repo_urls': {
+            repo['name']: parse.quote('/'.join([flask.url_for('repos'), repo['name']]))
+            for repo in result['repos']
+        },
+        'not_found': result['not_found']
+    }
     return flask.jsonify(response)
 
 
@@ -390,12 +655,15 @@ def update_downloads(repo):
     repo_url = parse.quote('/'.join([flask.url_for('repos'), repo]))
 
     try:
-        rpc.registry.update_downloads(repo)
+        downloads = rpc.registry.update_downloads(repo)
     except Exception as e:
         return resource_not_found('repos', repo)
 
+    if downloads is None:
+        return resource_not_found('repos', repo)
+
     response = {
-        'downloads': rpc.registry.get_repo(repo)['downloads'],
+        'downloads': downloads,
         'message': 'Repo({}) has been updated.'.format(repo),
         'repo_url': parse.quote('/'.join([flask.url_for('repos'), repo]))
     }
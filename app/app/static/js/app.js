@@ -34,8 +34,119 @@ function attach_search_event() {
 }
 
 
-function attach_download_event() {
-    $('.mdl-button').on('click', function() {
+function attach_query_event() {
+    $('#search_query').keypress(function(event) {
+        // search on enter
+        if (event.which !== 13) { return null; }
+
+        var query = $(this).val().trim();
+        if (query === '') { return null; }
+
+        var client_key = $.cookie('software-registry-client-key');
+        var url = 'http://192.168.99.100/repo_cards?client-key=' + client_key + '&q=' + encodeURIComponent(query);
+
+        $('#repo_cards_container').empty();
+        $.ajax({
+            url: url,
+            type: 'GET',
+            dataType: 'html',
+            success: function(data, status, jqXHR) {
+                $('#repo_cards_container').append(data);
+                attach_download_event();
+            }
+       });
+    });
+}
+
+
+function add_tag_chip(tag_name) {
+    // already rendered tags are only checked
+    var chips = $('#tags_container .mdl-chip__text');
+    for (i = 0; i < chips.length; i ++) {
+        if ($(chips[i]).text() === tag_name) {
+            $(chips[i]).siblings('label').children('input').prop('checked', true);
+            return null;
+        }
+    }
+
+    var checkbox_id = 'list-checkbox-completed-' + chips.length;
+    var chip = $('<span class="mdl-chip mdl-chip--deletable"></span>');
+    chip.append($('<span class="mdl-chip__text"></span>').text(tag_name));
+
+    var label = $('<label class="mdl-checkbox mdl-js-checkbox mdl-js-ripple-effect"></label>').attr('for', checkbox_id);
+    label.append($('<input type="checkbox" class="mdl-checkbox__input" checked/>').attr('id', checkbox_id));
+    chip.append(label);
+
+    $('#tag_query').parent().before(chip);
+    if (typeof componentHandler !== 'undefined') {
+        componentHandler.upgradeElement(label[0]);
+    }
+}
+
+
+function attach_tag_query_event() {
+    var completions = [];
+    var pending = null;
+
+    $('#tag_query').on('input', function() {
+        var prefix = $(this).val().trim();
+
+        // a completion picked from the list becomes a chip
+        if (completions.indexOf(prefix) !== -1) {
+            add_tag_chip(prefix);
+            $(this).val('');
+            return null;
+        }
+
+        clearTimeout(pending);
+        if (prefix === '') { return null; }
+
+        // wait for the typing to settle before asking for completions
+        pending = setTimeout(function() {
+            var client_key = $.cookie('software-registry-client-key');
+            var url = 'http://192.168.99.100/api/tags/complete?client-key=' + client_key + '&prefix=' + encodeURIComponent(prefix);
+
+            $.ajax({
+                url: url,
+                type: 'GET',
+                dataType: 'json',
+                success: function(data, status, jqXHR) {
+                    completions = [];
+                    $('#tag_completions').empty();
+                    for (i = 0; i < data.tag_details.length; i ++) {
+                        completions.push(data.tag_details[i][0]);
+                        $('#tag_completions').append($('<option></option>').attr('value', data.tag_details[i][0]));
+                    }
+                }
+           });
+        }, 200);
+    });
+}
+
+
+function attach_load_more_event() {
+    $('#repo_cards_container').on('click', '#load_more_repos button', function() {
+        var next_url = $(this).attr('data-next-url');
+        $('#load_more_repos').remove();
+
+        $.ajax({
+            url: 'http://192.168.99.100' + next_url,
+            type: 'GET',
+            dataType: 'html',
+            success: function(data, status, jqXHR) {
+                var cards = $($.parseHTML(data));
+                $('#repo_cards_container').append(cards);
+                attach_download_event(cards);
+            }
+       });
+    });
+}
+
+
+function attach_download_event(cards) {
+    // only the cards just rendered, earlier ones already have their event
+    var buttons = cards ? $(cards).find('.mdl-card__actions .mdl-button') : $('.mdl-card__actions .mdl-button');
+    buttons.on('click', function() {
         var download_button = $(this);
         var repo_name = $(download_button.parent()[0]).siblings('.mdl-card__title').children().text();
 
@@ -58,5 +169,8 @@ function attach_download_event() {
 $(document).ready(
     function() {
         attach_search_event();
+        attach_query_event();
+        attach_tag_query_event();
+        attach_load_more_event();
     }
 );
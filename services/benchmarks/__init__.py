@@ -0,0 +1,2 @@
+""" Microbenchmarks of the registry service, run against an in-memory sqlite db.
+"""
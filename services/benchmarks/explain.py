@@ -0,0 +1,126 @@
+""" EXPLAIN checks that the hot queries of the registry use the indexes of the schema.
+
+Run from the services directory, against a migrated db (an in-memory sqlite one by default):
+    python -m benchmarks.explain --uri mysql+pymysql://root:1234@db:3306/registry
+"""
+
+import argparse
+import sys
+import sqlalchemy
+from sqlalchemy import orm
+
+from registry._impl import db, migrations
+
+
+# hot queries, the index expected in their plan per table.
+CHECKS = [
+    (
+        'most popular tags',
+        lambda wrapper: wrapper.get_tags(limit=100),
+        {'tags': ['ix_tags_popularity']},
+    ),
+    (
+        'page of all the repositories',
+        lambda wrapper: wrapper.get_repos_from_tags(limit=50),
+        {'repositories': ['ix_repositories_downloads_name']},
+    ),
+    (
+        'page of the repositories of any tag',
+        lambda wrapper: wrapper.get_repos_from_tags(['tag1', 'tag2'], limit=50),
+        {
+            'repositories': ['ix_repositories_downloads_name'],
+            'repositories_tags': ['PRIMARY', 'sqlite_autoindex_repositories_tags_1',
+                                  'ix_repositories_tags_repo_id_tag_id'],
+        },
+    ),
+    (
+        'page of the repositories of all the tags',
+        lambda wrapper: wrapper.get_repos_from_tags(['tag1', 'tag2'], match='all', limit=50),
+        {'repositories_tags': ['PRIMARY', 'sqlite_autoindex_repositories_tags_1']},
+    ),
+]
+
+
+def explain(connection, statement, parameters):
+    """ Indexes used per table by the statement.
+
+        Returns:
+            dict: index names per table (alias) name.
+    """
+    indexes = {}
+
+    if connection.dialect.name == 'mysql':
+        for row in connection.exec_driver_sql('EXPLAIN ' + statement, parameters).mappings():
+            indexes.setdefault(row['table'], set()).add(row['key'])
+    else:
+        for row in connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters):
+            # e.g. SEARCH repositories_tags USING COVERING INDEX ix_... (repo_id=?)
+            words = row[-1].split()
+            if len(words) > 1 and words[0] in ('SCAN', 'SEARCH'):
+                index = words[words.index('INDEX') + 1] if 'INDEX' in words else None
+                indexes.setdefault(words[1], set()).add(index)
+
+    return indexes
+
+
+def seed(session, repos=1000, tags=50):
+    wrapper = db.RegistryDatabaseSessionWrapper(session)
+    tag_names = ['tag{}'.format(index) for index in range(tags)]
+    wrapper.add_tags(tag_names)
+    wrapper.add_repos([
+        {
+            'name': 'repo{}'.format(index),
+            'description': '',
+            'uri': 'repo{}'.format(index),
+            'tags': [tag_names[index % tags], tag_names[(index * 7) % tags]]
+        }
+        for index in range(repos)
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uri', default=None, help='db to check, it is not modified')
+    args = parser.parse_args()
+
+    engine = sqlalchemy.create_engine(args.uri or 'sqlite://')
+    if not args.uri:
+        migrations.upgrade(engine)
+    session = orm.sessionmaker(bind=engine)()
+    if not args.uri:
+        seed(session)
+
+    statements = []
+    sqlalchemy.event.listen(
+        engine,
+        'before_cursor_execute',
+        lambda conn, cursor, statement, parameters, context, executemany: statements.append((statement, parameters))
+    )
+
+    failures = 0
+    wrapper = db.RegistryDatabaseSessionWrapper(session)
+    for name, run, expected in CHECKS:
+        del statements[:]
+        run(wrapper)
+
+        used = {}
+        with engine.connect() as connection:
+            for statement, parameters in list(statements):
+                if statement.lstrip().upper().startswith('SELECT'):
+                    for table, indexes in explain(connection, statement, parameters).items():
+                        used.setdefault(table, set()).update(indexes)
+
+        missing = [
+            table for table, indexes in expected.items()
+            if not used.get(table, set()).intersection(indexes)
+        ]
+        failures += bool(missing)
+        print('{:<45} {}'.format(name, 'FAIL ({})'.format(', '.join(missing)) if missing else 'ok'))
+        for table, indexes in sorted(used.items()):
+            print('    {:<30} {}'.format(table, ', '.join(sorted(str(index) for index in indexes))))
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
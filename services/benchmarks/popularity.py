@@ -0,0 +1,84 @@
+""" Microbenchmark of the popularity update against the number of tags per request.
+
+Run from the services directory:
+    python -m benchmarks.popularity --sizes 1 10 100 1000
+"""
+
+import argparse
+import random
+import timeit
+import sqlalchemy
+from sqlalchemy import orm
+
+from registry._impl import db, models
+
+
+def legacy_update_popularity(session, tags):
+    """ Previous update: quadratic count and one UPDATE per tag on flush.
+    """
+    tag_counts = {}
+    for tag in tags:
+        if tag not in tag_counts.keys():
+            tag_counts[tag] = tags.count(tag)
+
+    tags = session.query(models.Tag)\
+        .filter(models.Tag.name.in_(tag_counts.keys()))\
+        .all()
+
+    for tag in tags:
+        tag.popularity = models.Tag.popularity + tag_counts[tag.name]
+
+    session.commit()
+
+
+def create_session(tag_names):
+    engine = sqlalchemy.create_engine('sqlite://')
+    models.DeclarativeBase.metadata.create_all(engine)
+    session = orm.sessionmaker(bind=engine)()
+
+    session.add_all([models.Tag(name=name, popularity=0) for name in tag_names])
+    session.commit()
+
+    statements = []
+    sqlalchemy.event.listen(
+        engine,
+        'before_cursor_execute',
+        lambda *args: statements.append(args[2])
+    )
+    return session, statements
+
+
+def measure(update, tags, tag_names, number):
+    session, statements = create_session(tag_names)
+    seconds = timeit.timeit(lambda: update(session, tags), number=number)
+    return seconds / number * 1000, len(statements) // number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100, 1000, 5000])
+    parser.add_argument('--number', type=int, default=20, help='runs per size')
+    args = parser.parse_args()
+
+    tag_names = ['tag{}'.format(index) for index in range(max(args.sizes))]
+
+    print('{:>8} {:>12} {:>12} {:>12} {:>12}'.format(
+        'tags', 'legacy ms', 'set ms', 'legacy stmts', 'set stmts'
+    ))
+    for size in args.sizes:
+        # requests repeat tags, half of them are distinct.
+        tags = [random.choice(tag_names[:max(size // 2, 1)]) for _ in range(size)]
+
+        legacy_ms, legacy_statements = measure(legacy_update_popularity, tags, tag_names, args.number)
+        set_ms, set_statements = measure(
+            lambda session, tags: db.RegistryDatabaseSessionWrapper(session).update_popularity(tags),
+            tags, tag_names, args.number
+        )
+
+        print('{:>8} {:>12.3f} {:>12.3f} {:>12} {:>12}'.format(
+            size, legacy_ms, set_ms, legacy_statements, set_statements
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+""" Checks of the routing of the reads between the primary db and its replicas.
+
+Stand-in dbs are sqlite files, a primary and two replicas, each one holding a tag
+named after it so that a read tells which db served it. Run from the services directory:
+    python -m benchmarks.replicas
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import sqlalchemy
+from sqlalchemy import orm
+
+from registry._impl import db, migrations
+
+
+# stand-in dbs, named after their role.
+DBS = ('primary', 'replica1', 'replica2')
+
+
+def create_engine(directory, name):
+    engine = sqlalchemy.create_engine('sqlite:///{}'.format(os.path.join(directory, name + '.db')))
+    migrations.upgrade(engine)
+    session = orm.Session(bind=engine)
+    db.RegistryDatabaseSessionWrapper(session).add_tags([name])
+    session.close()
+    return engine
+
+
+def served_by(wrapper):
+    """ Name of the db the read of the wrapper (worker) is served by.
+    """
+    names = {tag.name for tag in wrapper.get_tags()}
+    return names.intersection(DBS).pop()
+
+
+def check_round_robin(primary, router, staleness):
+    workers = [db.RegistryDatabaseSessionWrapper(primary(), router) for _ in range(4)]
+    return [served_by(worker) for worker in workers] == ['replica1', 'replica2', 'replica1', 'replica2']
+
+
+def check_read_after_write(primary, router, staleness):
+    worker = db.RegistryDatabaseSessionWrapper(primary(), router)
+    worker.add_tags(['written'])
+    return served_by(worker) == 'primary'
+
+
+def check_staleness(primary, router, staleness):
+    db.RegistryDatabaseSessionWrapper(primary(), router).add_tags(['written'])
+    during = served_by(db.RegistryDatabaseSessionWrapper(primary(), router))
+    time.sleep(staleness)
+    after = served_by(db.RegistryDatabaseSessionWrapper(primary(), router))
+    return during == 'primary' and after.startswith('replica')
+
+
+def check_ejection(primary, router, staleness):
+    # the first replica can't be opened, its read is run again on the primary.
+    broken = router.engines[0]
+    router.engines[0] = sqlalchemy.create_engine('sqlite:////nonexistent/replica1.db')
+    try:
+        failed = served_by(db.RegistryDatabaseSessionWrapper(primary(), router))
+        ejected = [served_by(db.RegistryDatabaseSessionWrapper(primary(), router)) for _ in range(2)]
+
+        router.eject(router.engines[1])
+        all_ejected = served_by(db.RegistryDatabaseSessionWrapper(primary(), router))
+    finally:
+        router.engines[0] = broken
+
+    return failed == 'primary' and ejected == ['replica2', 'replica2'] and all_ejected == 'primary'
+
+
+CHECKS = [
+    ('reads spread over the replicas', check_round_robin),
+    ('reads of a worker after its write', check_read_after_write),
+    ('reads while replicas may lag behind', check_staleness),
+    ('reads after a replica failure', check_ejection),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--staleness', type=float, default=0.2, help='seconds')
+    args = parser.parse_args()
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(directory, 'primary')
+        replicas = [create_engine(directory, name) for name in DBS[1:]]
+        primary = orm.sessionmaker(bind=engine)
+
+        for name, check in CHECKS:
+            # a fresh router per check, as a container would have.
+            router = db.ReplicaRouter(list(replicas), args.staleness, eject_for=60)
+            ok = check(primary, router, args.staleness)
+            failures += not ok
+            print('{:<45} {}'.format(name, 'ok' if ok else 'FAIL'))
+
+        for replica in replicas + [engine]:
+            replica.dispose()
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
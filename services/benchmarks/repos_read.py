@@ -0,0 +1,87 @@
+""" Benchmark of the repositories read path: ORM objects against core selects.
+
+Run from the services directory:
+    python -m benchmarks.repos_read --repos 100000
+"""
+
+import argparse
+import time
+import tracemalloc
+import sqlalchemy
+from sqlalchemy import orm
+
+from registry._impl import db, models
+
+
+def orm_read(session, chunk_size=1000):
+    """ Previous read: Repository objects hydrated in the identity map, then turned into dicts.
+        Tags are fetched the same way for both paths.
+    """
+    repos = session.query(models.Repository)\
+        .order_by(models.Repository.downloads.desc(), models.Repository.name.desc())\
+        .all()
+
+    wrapper = db.RegistryDatabaseSessionWrapper(session)
+    return [
+        repo
+        for index in range(0, len(repos), chunk_size)
+        for repo in wrapper._with_tags(session, repos[index:index + chunk_size])
+    ]
+
+
+def core_read(session):
+    return db.RegistryDatabaseSessionWrapper(session).get_repos_from_tags()
+
+
+def create_session(repos, tags_per_repo):
+    engine = sqlalchemy.create_engine('sqlite://')
+    models.DeclarativeBase.metadata.create_all(engine)
+    session = orm.sessionmaker(bind=engine)()
+
+    wrapper = db.RegistryDatabaseSessionWrapper(session)
+    tag_names = ['tag{}'.format(index) for index in range(100)]
+    wrapper.add_tags(tag_names)
+    wrapper.add_repos([
+        {
+            'name': 'repo{}'.format(index),
+            'description': 'description of repo{}'.format(index),
+            'uri': 'https://example.com/repo{}'.format(index),
+            'tags': [tag_names[(index + offset) % len(tag_names)] for offset in range(tags_per_repo)]
+        }
+        for index in range(repos)
+    ])
+    return session
+
+
+def measure(read, session):
+    # a new session per run, nothing is left in the identity map.
+    session.expunge_all()
+    start = time.process_time()
+    rows = len(read(session))
+    cpu = time.process_time() - start
+
+    session.expunge_all()
+    tracemalloc.start()
+    read(session)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return rows, cpu / rows * 1e6, peak / rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repos', type=int, default=100000)
+    parser.add_argument('--tags', type=int, default=3, help='tags per repository')
+    args = parser.parse_args()
+
+    session = create_session(args.repos, args.tags)
+
+    print('{:>8} {:>10} {:>14} {:>16}'.format('path', 'rows', 'cpu us/row', 'peak bytes/row'))
+    for name, read in [('orm', orm_read), ('core', core_read)]:
+        rows, cpu, memory = measure(read, session)
+        print('{:>8} {:>10} {:>14.2f} {:>16.0f}'.format(name, rows, cpu, memory))
+
+
+if __name__ == '__main__':
+    main()
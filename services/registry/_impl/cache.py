@@ -1,43 +1,218 @@
 """ Caching operations for the service.
 """
 
+import collections
+import json
 import logging
+import time
+import uuid
+import eventlet
 import nameko_redis
 
 import registry
 
+from . import (
+    codec,
+    local_cache,
+    scripts as _scripts
+)
+
 
 # REVIEW: what about having cache as a service
 
+# member of the tags set marking it as loaded with all the tags from db. It lives and dies
+# with the set, a set recreated by later adds is partial. Its score keeps it out of the ranges.
+TAGS_LOADED = '\x00loaded'
+
+# separates the folded tag name, on which prefixes are matched, from the tag name in the index.
+INDEX_SEPARATOR = '\x00'
+
+
+def _index_entry(tag):
+    return '{}{}{}'.format(tag.lower(), INDEX_SEPARATOR, tag)
+
 
 class RegistryCache(nameko_redis.Redis):
     """ Sub-class of redis nameko extension.
     """
     def __init__(self):
         super().__init__(registry.config['CACHE']['LAYER'])
+        self.scripts = None
+        self.local = local_cache.LocalCache(
+            registry.config['CACHE']['LOCAL']['SIZE'],
+            registry.config['CACHE']['LOCAL']['TTL'],
+        )
+        self.pubsub = None
+        # in-process fills in flight, per tag.
+        self.flights = {}
+
+    def start(self):
+        super().start()
+        self.scripts = _scripts.Scripts(self.client)
+
+        self.container.spawn_managed_thread(self.listen)
+
+        if registry.config['CACHE'].get('MIGRATE_ON_START'):
+            self.container.spawn_managed_thread(self.migrate)
+
+    def stop(self):
+        if self.pubsub is not None:
+            self.pubsub.close()
+            self.pubsub = None
+        super().stop()
+
+    def kill(self):
+        self.pubsub = None
+        super().kill()
+
+    def listen(self):
+        """ Apply the invalidations published by the service instances
+            to the local cache.
+        """
+        channel = self.wrapper().invalidation_channel
+
+        while self.client is not None:
+            try:
+                self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                self.pubsub.subscribe(channel)
+
+                # invalidations could have been missed while not subscribed.
+                self.local.clear()
+
+                for message in self.pubsub.listen():
+                    for namespace, name in json.loads(message['data']):
+                        self.local.invalidate(namespace, name)
+            except Exception:
+                if self.client is None:
+                    break
+                registry.logger.error('Exception occurred while listening cache invalidations.', exc_info=True)
+                self.local.clear()
+                time.sleep(1)
+
+    def migrate(self):
+        """ Migrate the legacy cache entries to the current encoding.
+        """
+        try:
+            self.wrapper().migrate_repos()
+        except Exception:
+            registry.logger.error('Exception occurred while migrating cache.', exc_info=True)
+
+    def wrapper(self):
+        """ Create the wrapper defining the cache operations.
+
+            Returns:
+                RegistryCacheWrapper: cache wrapper for the current client.
+        """
+        return RegistryCacheWrapper(self.client, self.scripts, self.local, self.flights)
 
     def get_dependency(self, worker_ctx):
-        return RegistryCacheWrapper(self.client)
+        return self.wrapper()
 
 
 class RegistryCacheWrapper(object):
     """ Registry cache wrapper class which defines all the cache operations.
     """
 
-    def __init__(self, client):
+    def __init__(self, client, scripts, local, flights):
         self.cache_key = registry.config['CACHE']['KEY']
         self.delimiter = registry.config['CACHE']['DELIMITER']
         self.client = client
+        self.scripts = scripts
+        self.local = local
+        self.flights = flights
 
         self.tags_key = self.delimiter.join([self.cache_key, 'tags'])
+        self.tags_index_key = self.delimiter.join([self.cache_key, 'tags_index'])
+        # set once the index holds all the tags, an index recreated by later adds is partial.
+        self.tags_index_built_key = self.delimiter.join([self.tags_index_key, 'built'])
         self.labels_key = self.delimiter.join([self.cache_key, 'labels'])
         self.repos_key = self.delimiter.join([self.cache_key, 'repos'])
+        self.invalidation_channel = self.delimiter.join([self.cache_key, 'invalidation'])
+
+        self.ttls = registry.config['CACHE']['TTL']
+        self.max_label_size = registry.config['CACHE']['MAX_LABEL_SIZE']
+
+    def expire(self, pipe, key, keyspace):
+        """ Set (or refresh) the time to live of the key.
+
+            Args:
+                pipe (Pipeline): pipeline holding the write.
+                key (str): key to expire.
+                keyspace (str): keyspace of the key i.e. tags, labels or repos.
+        """
+        ttl = self.ttls.get(keyspace)
+        if ttl:
+            pipe.expire(key, ttl)
+
+    def fill_repos(self, pipe, repos, tags=None):
+        """ Write the repositories from db and add them to their labels, in a single script call.
+            Downloads are the greatest of db, the running totals (counted but not flushed yet)
+            and the cache, a fill never lowers them. Labels keep only the most downloaded ones.
+
+            Args:
+                pipe (Pipeline): pipeline holding the write.
+                repos (list): list of repositories (dict) from db.
+
+            Kwargs:
+                tags (list): labels the repositories are added to, None means their cached labels
+                            (repositories without any are not written).
+        """
+        args = [
+            self.repos_key + self.delimiter,
+            self.labels_key + self.delimiter,
+            self.ttls.get('labels') or 0,
+            self.ttls.get('repos') or 0,
+            self.max_label_size or 0,
+            1 if tags is None else 0,
+        ]
+        for repo in repos:
+            labels = repo['tags'] if tags is None else set(repo['tags']).intersection(tags)
+            args.extend([
+                repo['name'],
+                json.dumps(codec.encode_repo({
+                    'description': repo['description'],
+                    'uri': repo['uri'],
+                    'tags': repo['tags'],
+                    'downloads': repo['downloads']
+                })),
+                codec.encode_tags(labels),
+            ])
+
+        self.scripts.fill_repos(
+            keys=[self.delimiter.join([self.cache_key, 'downloads'])],
+            args=args,
+            client=pipe,
+        )
+
+    def invalidate(self, pipe, entries):
+        """ Invalidate the local cache entries of all the service instances.
+            Invalidation is published with the given pipeline.
+
+            Args:
+                pipe (Pipeline): pipeline holding the write.
+                entries (list): pairs of namespace and name (None for whole namespace).
+        """
+        for namespace, name in entries:
+            self.local.invalidate(namespace, name)
 
-    def add_tags(self, tags):
+        pipe.publish(self.invalidation_channel, json.dumps(entries))
+
+    def local_stats(self):
+        """ Get the statistics of the local cache.
+
+            Returns:
+                dict: hits, misses, evictions and size of the local cache.
+        """
+        return self.local.stats()
+
+    def add_tags(self, tags, nx=False):
         """ Add the tags to the cache.
 
             Args:
                 tags (list): list of tags that would be inserted in cache.
+
+            Kwargs:
+                nx (bool): only add new tags, popularity of cached ones is kept.
         """
         items = []
         for tag in tags:
@@ -45,20 +220,54 @@ class RegistryCacheWrapper(object):
             items.append(tag[0])  # tag name
 
         with self.client.pipeline() as pipe:
-            pipe.zadd(self.tags_key, *items).execute()
+            if nx:
+                pipe.execute_command('ZADD', self.tags_key, 'NX', *items)
+            else:
+                pipe.zadd(self.tags_key, *items)
+            self.expire(pipe, self.tags_key, 'tags')
+            self.index_tags(pipe, [tag[0] for tag in tags])
+            self.invalidate(pipe, [('tags', None)])
+            pipe.execute()
             registry.logger.debug('Tags({}) tags are added to cache.'.format(tags))
 
-    def get_tags(self, tags):
+    def load_tags(self, tags):
+        """ Load all the tags in the cache, marking the set as complete.
+
+            Args:
+                tags (list): all the tags (name, popularity) from db.
+        """
+        items = [-1, TAGS_LOADED]
+        for tag in tags:
+            items.append(int(tag[1]))  # popularity as score
+            items.append(tag[0])  # tag name
+
+        with self.client.pipeline() as pipe:
+            pipe.zadd(self.tags_key, *items)
+            self.expire(pipe, self.tags_key, 'tags')
+            self.index_tags(pipe, [tag[0] for tag in tags])
+            self.invalidate(pipe, [('tags', None)])
+            pipe.execute()
+
+        registry.logger.debug('Tags({}) are loaded in cache.'.format(len(tags)))
+
+    def get_tags(self, tags, limit=None):
         """ Get the tags from the cache.
 
             Args:
                 tags (list): list of tags that would be fetched from cache.
 
+            Kwargs:
+                limit (int): maximum number of the most popular tags fetched when no tags are given.
+
             Retuns:
                 tuple: pair of tags cached tags and non cached tags.
         """
         key = self.delimiter.join([self.cache_key, 'tags'])
 
+        cached_tags = self.local.get('tags', (tuple(tags), limit))
+        if cached_tags is not local_cache.MISSING:
+            return list(cached_tags), []
+
         registry.logger.debug('Get details for Tag({}) from cache.'.format(tags))
         with self.client.pipeline() as pipe:
             if tags:
@@ -67,7 +276,8 @@ class RegistryCacheWrapper(object):
                 for tag in tags:
                     pipe.zscore(key, tag)
 
-                popularity = pipe.execute()
+                self.expire(pipe, key, 'tags')
+                popularity = pipe.execute()[:len(tags)]
 
                 for tag, popularity in zip(tags, popularity):
                     if popularity:
@@ -77,73 +287,173 @@ class RegistryCacheWrapper(object):
 
                 registry.logger.debug('Cached tags: {}\nNon cached tags: {}.'.format(cached_tags, non_cached_tags))
 
+                if not non_cached_tags:
+                    self.local.set('tags', (tuple(tags), limit), tuple(cached_tags))
+
                 return cached_tags, non_cached_tags
 
             else:
-                cached_tags = pipe.zrevrangebyscore(key, '+inf', 0, withscores=True).execute()
+                pipe.zscore(key, TAGS_LOADED)
+                if limit:
+                    pipe.zrevrangebyscore(key, '+inf', 0, start=0, num=limit, withscores=True)
+                else:
+                    pipe.zrevrangebyscore(key, '+inf', 0, withscores=True)
+                self.expire(pipe, key, 'tags')
+                loaded, cached_tags = pipe.execute()[:2]
+
+                # a partial set is not all the tags.
+                if loaded is None:
+                    return [], []
+
                 cached_tags = [
                     (tag, int(popularity))
-                    for tag, popularity in cached_tags[0]
+                    for tag, popularity in cached_tags
                 ]
 
                 registry.logger.debug('Cached tags: {}\nNon cached tags: {}.'.format(cached_tags, []))
 
+                if cached_tags:
+                    self.local.set('tags', ((), limit), tuple(cached_tags))
+
                 return cached_tags, []
 
-    def update_repos(self, repos):
-        """ Update the repositories entries in cache
-            if any of its corresponding tags exist in cache.
+    def index_tags(self, pipe, tags):
+        """ Add the tags to the prefix index, a sorted set ordered lexicographically
+            (all scores are 0) on the lower cased tag names. It has no time to live,
+            as it should know every tag.
 
             Args:
-                repos (list): list of repositories that would be updated in cache.
+                pipe (Pipeline): pipeline holding the write.
+                tags (list): tag names.
         """
-        repo_names = [repo for repo in repos]
+        items = []
+        for tag in tags:
+            items.append(0)
+            items.append(_index_entry(tag))
 
-        with self.client.pipeline() as pipe:
-            repos_to_add = []
-            labels_to_add = []
+        if items:
+            pipe.zadd(self.tags_index_key, *items)
 
-            for repo in repos:
+    def build_tags_index(self, load, force=False):
+        """ Build the prefix index of all the tags, once across the instances.
+            Index is written aside and merged in, completions keep being served meanwhile.
 
-                label_names = []
+            Args:
+                load (callable): returns all the tag names.
 
-                for tag in repo.labels:
-                    pipe.zadd(self.tags_key, 0, tag.name)
-                    label_names.append(tag.name)
+            Kwargs:
+                force (bool): rebuild the index even if it exists.
 
+            Returns:
+                int: number of indexed tags, None if the index is built elsewhere or already built.
+        """
+        if not force and self.client.exists(self.tags_index_built_key):
+            return None
+
+        lock_key = self.delimiter.join([self.tags_index_key, 'lock'])
+        token = str(uuid.uuid4())
+        if not self.client.set(lock_key, token, nx=True, ex=registry.config['TAGS']['INDEX_LOCK_TIMEOUT']):
+            return None
+
+        try:
+            tags = load()
+            building_key = self.delimiter.join([self.tags_index_key, 'building', token])
+
+            with self.client.pipeline() as pipe:
+                chunk_size = registry.config['TAGS']['INDEX_CHUNK_SIZE']
+                for i in range(0, len(tags), chunk_size):
+                    items = []
+                    for tag in tags[i:i + chunk_size]:
+                        items.append(0)
+                        items.append(_index_entry(tag))
+                    pipe.zadd(building_key, *items)
+                    pipe.execute()
+
+                # merged rather than renamed, tags indexed by add_tags meanwhile are kept.
+                pipe.zunionstore(self.tags_index_key, [self.tags_index_key, building_key])
+                pipe.delete(building_key)
+                pipe.set(self.tags_index_built_key, 1)
+                self.invalidate(pipe, [('tags', None)])
                 pipe.execute()
+        finally:
+            self.scripts.release_locks(keys=[lock_key], args=[token])
 
-                for label in label_names:
-                    # add the repo iff this tag exists in labels.
-                    label_item_key = self.delimiter.join([self.labels_key, label])
-                    if not pipe.exists(label_item_key).execute()[0]:
-                        continue
+        registry.logger.info('Tags({}) indexed for completion.'.format(len(tags)))
 
-                    labels_to_add.append([label_item_key, repo.downloads, repo.name])
+        return len(tags)
 
-                    repo_item_key = self.delimiter.join([self.repos_key, repo.name])
-                    if pipe.exists(repo_item_key).execute()[0]:
-                        continue
+    def complete_tags(self, prefix, limit):
+        """ Get the tags starting with the prefix (case insensitive) from the index.
+            The first candidates in lexicographic order are ranked by their cached popularity.
 
-                    repos_to_add.append({
-                        'name': repo.name,
-                        'description': repo.description,
-                        'uri': repo.uri,
-                        'tags': label_names,
-                        'downloads': repo.downloads
-                    })
+            Args:
+                prefix (str): prefix of the tag names.
+                limit (int): maximum number of tags.
 
-            for repo in repos_to_add:
-                key = self.delimiter.join([self.repos_key, repo['name']])
-                pipe.hmset(key, repo)
+            Returns:
+                list: pairs of tag name and popularity, None if the index is not built.
+        """
+        local_key = ('complete', prefix.lower(), limit)
+        completed_tags = self.local.get('tags', local_key)
+        if completed_tags is not local_cache.MISSING:
+            return list(completed_tags)
 
-            for label in labels_to_add:
-                pipe.zadd(*label)
+        # utf-8 encoded names never contain the byte 0xff.
+        start = prefix.lower().encode()
+        with self.client.pipeline() as pipe:
+            pipe.exists(self.tags_index_built_key)
+            pipe.zrangebylex(
+                self.tags_index_key,
+                b'[' + start,
+                b'[' + start + b'\xff',
+                start=0,
+                num=registry.config['TAGS']['COMPLETE_CANDIDATES']
+            )
+            built, entries = pipe.execute()
+
+            if not built:
+                return None
+
+            tags = [entry.split(INDEX_SEPARATOR, 1)[1] for entry in entries]
+            for tag in tags:
+                pipe.zscore(self.tags_key, tag)
+            popularity = pipe.execute()
 
+        completed_tags = sorted(
+            [(tag, int(score or 0)) for tag, score in zip(tags, popularity)],
+            key=lambda tag: (-tag[1], tag[0])
+        )[:limit]
+
+        self.local.set('tags', local_key, tuple(completed_tags))
+
+        registry.logger.debug('Tags({}) completed for Prefix({}).'.format(completed_tags, prefix))
+
+        return completed_tags
+
+    def update_repos(self, repos):
+        """ Update the repositories entries in cache
+            if any of its corresponding tags exist in cache.
+            Takes a single round trip whatever the number of repositories.
+
+            Args:
+                repos (list): list of repositories (dict) that would be updated in cache.
+        """
+        with self.client.pipeline() as pipe:
+            for repo in repos:
+                for label in repo['tags']:
+                    pipe.execute_command('ZADD', self.tags_key, 'NX', 0, label)
+                self.index_tags(pipe, repo['tags'])
+
+            # add the repo iff any of its tags exists in labels.
+            self.fill_repos(pipe, repos)
+
+            self.expire(pipe, self.tags_key, 'tags')
+            self.invalidate(pipe, [('tags', None), ('repos', None), ('repos_all', None)] + [
+                ('repo', repo['name']) for repo in repos
+            ])
             pipe.execute()
 
-        registry.logger.debug('Labels({}) are added to cache.'.format([label[0] for label in labels_to_add]))
-        registry.logger.debug('Repos({}) added to cache.'.format(repo_names))
+        registry.logger.debug('Repos({}) added to cache.'.format([repo['name'] for repo in repos]))
 
     def add_repos(self, tags, repos):
         """ Add the repositories entries in cache.
@@ -160,85 +470,134 @@ class RegistryCacheWrapper(object):
             for tag in tags:
                 pipe.zincrby(self.tags_key, tag)
 
-            for repo in repos:
-                labels = [label.name for label in repo.labels]
-                to_update_tags = set(labels).intersection(tags)
+            self.fill_repos(pipe, repos, tags)
+            self.expire(pipe, self.tags_key, 'tags')
+            pipe.execute()
 
-                for tag in to_update_tags:
-                    label_item_key = self.delimiter.join([self.labels_key, tag])
-                    pipe.zadd(label_item_key, repo.downloads, repo.name)
+        # only the popularity changed, other instances catch up on expiry.
+        self.local.invalidate('tags')
 
-                key = self.delimiter.join([self.repos_key, repo.name])
-                pipe.hmset(key, {
-                    'name': repo.name,
-                    'description': repo.description,
-                    'uri': repo.uri,
-                    'tags': labels,
-                })
+    def warm_up(self, tags, repos):
+        """ Add the repositories entries in cache for the tags, without counting popularity.
 
-            pipe.execute()
+            Args:
+                tags (list): list of tags for which repositories are added.
+                repos (list): list of repositories that would be added in cache.
+
+            Returns:
+                int: number of keys written.
+        """
+        with self.client.pipeline() as pipe:
+            self.fill_repos(pipe, repos or [], tags)
+            self.expire(pipe, self.tags_key, 'tags')
+            keys = pipe.execute()[0]
 
-    def get_repos_from_tags(self, tags=None):
+        return keys
+
+    def get_repos_from_tags(self, tags=None, limit=None, cursor=None):
         """ Get the repositories from the cache based on given tags.
+            All the tags are resolved in a single server side script call,
+            merging the labels until the page is full.
 
             Args:
                 tags (list): list of tags for which the repositories will be fetched from cache.
+                            None means all the cached tags.
+
+            Kwargs:
+                limit (int): maximum number of repositories fetched, None means all of them.
+                cursor (list): (downloads, name) of the last repository of the previous page.
 
             Retuns:
-                tuple: pair of tags cached tags and non cached tags.
+                tuple: cached repositories (ranked by downloads), non cached tags
+                       and capped tags (read to the end of their label, to be completed from db).
         """
-        tags = tags or [name for name, download in self.get_tags(tags)[0]]
+        tags = tuple(tags or [])
+        page = (tags, limit, tuple(cursor or ()))
+
+        result = self.local.get('repos', page)
+        if result is not local_cache.MISSING:
+            return list(result), [], []
 
         registry.logger.debug('Get the repos for Tags({}) from cache.'.format(tags))
 
-        non_cached_tags = []
-        result = []
+        non_cached_tags, repos, capped_tags = self.scripts.get_repos_from_tags(args=[
+            self.tags_key,
+            self.labels_key + self.delimiter,
+            self.repos_key + self.delimiter,
+            self.ttls.get('labels') or 0,
+            self.ttls.get('repos') or 0,
+            self.max_label_size or 0,
+        ] + self._page_args(limit, cursor) + list(tags))
 
-        with self.client.pipeline() as pipe:
-            # get repos per tag basis
-            repos = []
-            for tag in tags:
+        result = [
+            codec.decode_repo(repo, dict(zip(fields[::2], fields[1::2])), int(float(downloads)))
+            for repo, downloads, fields in repos
+        ]
 
-                label_item_key = self.delimiter.join([self.labels_key, tag])
+        registry.logger.debug('Repos({}) fetched from cache. Non Cahed Tags({}) Capped Tags({})'.format(
+            result, non_cached_tags, capped_tags
+        ))
 
-                repos_per_tag = []
-                if pipe.exists(label_item_key).execute()[0]:
-                    repos_per_tag = pipe.zrevrangebyscore(
-                        label_item_key, '+inf', 0, withscores=True).execute()[0]
+        if result and not non_cached_tags and not capped_tags:
+            self.local.set('repos', page, tuple(result))
 
-                    repo_names = [repo[0] for repo in repos_per_tag]
-                    registry.logger.debug('Repos({}) under Label({}).'.format(repo_names, label_item_key))
+        return result, list(non_cached_tags), list(capped_tags)
 
-                # if tag doesn't exists in cache
-                # skip it and eventually get its result from db
-                if repos_per_tag:
-                    for r in repos_per_tag:
-                        if r not in repos:
-                            repos.append(r)
-                else:
-                    non_cached_tags.append(tag)
+    def get_repos_with_all_tags(self, tags, limit=None, cursor=None):
+        """ Get the repositories having all the given tags from the cache,
+            intersected server side in a single script call.
 
-            for repo, downloads in repos:
-                repo_item_key = self.delimiter.join([self.repos_key, repo])
+            Args:
+                tags (list): list of tags all the repositories must have.
 
-                if not pipe.exists(repo_item_key).execute()[0]:
-                    continue
+            Kwargs:
+                limit (int): maximum number of repositories fetched, None means all of them.
+                cursor (list): (downloads, name) of the last repository of the previous page.
+
+            Retuns:
+                tuple: pair of cached repositories (ranked by downloads) and non cached tags,
+                       no repositories are returned unless all the tags are cached.
+        """
+        tags = tuple(tags)
+        page = (tags, limit, tuple(cursor or ()))
 
-                repo_item = pipe.hgetall(repo_item_key).execute()[0]
-                repo_item.update({
-                    'name': repo,
-                    'downloads': int(downloads)
-                })
-                result.append(repo_item)
+        result = self.local.get('repos_all', page)
+        if result is not local_cache.MISSING:
+            return list(result), []
 
-            pipe.execute()
+        registry.logger.debug('Get the repos with all Tags({}) from cache.'.format(tags))
+
+        non_cached_tags, repos = self.scripts.get_repos_with_all_tags(args=[
+            self.labels_key + self.delimiter,
+            self.repos_key + self.delimiter,
+            self.ttls.get('labels') or 0,
+            self.ttls.get('repos') or 0,
+            self.max_label_size or 0,
+            self.delimiter.join([self.cache_key, 'tmp', uuid.uuid4().hex]),
+        ] + self._page_args(limit, cursor) + list(tags))
+
+        result = [
+            codec.decode_repo(repo, dict(zip(fields[::2], fields[1::2])), int(float(downloads)))
+            for repo, downloads, fields in repos
+        ]
+
+        registry.logger.debug('Repos({}) fetched from cache. Non Cahed Tags({})'.format(result, non_cached_tags))
 
-        registry.logger.debug('Repos({}) added in cache. Non Cahed Tags({})'.format(result, non_cached_tags))
+        if not non_cached_tags:
+            self.local.set('repos_all', page, tuple(result))
 
-        return result, non_cached_tags
+        return result, list(non_cached_tags)
+
+    def _page_args(self, limit, cursor):
+        """ Script arguments of the page: limit (0 means no limit), cursor downloads and name.
+        """
+        cursor_downloads, cursor_name = cursor or ('', '')
+        return [limit or 0, cursor_downloads, cursor_name]
 
     def get_repo_details(self, repo):
         """ Get the repository details from the cache.
+            Downloads are read from the repository entry, the source of the cached downloads
+            (labels rank the repositories by the same downloads, every write raises both).
 
             Args:
                 repo (str): name of the repository for which details will be presented.
@@ -248,60 +607,383 @@ class RegistryCacheWrapper(object):
         """
         key = self.delimiter.join([self.repos_key, repo])
 
-        with self.client.pipeline() as pipe:
-            details = pipe.hgetall(key).execute()[0]
+        details = self.local.get('repo', repo)
+        if details is not local_cache.MISSING:
+            return details
 
-            if not details:
-                return {}
+        with self.client.pipeline() as pipe:
+            pipe.hgetall(key)
+            self.expire(pipe, key, 'repos')
+            fields = pipe.execute()[0]
 
-            details['tags'] = eval(details['tags'])
-            for label in details['tags']:
-                label_item_key = self.delimiter.join([self.labels_key, label])
-                if not pipe.exists(label_item_key).execute()[0]:
-                    continue
+        if not fields:
+            return {}
 
-                downloads = pipe.zscore(label_item_key, repo).execute[0]
-                dsetails['downloads'] = int(downloads)
+        details = codec.decode_repo(repo, fields)
 
-                # checking single label is enough because
-                # for any tag, repository details would be the same
-                break
+        self.local.set('repo', repo, details)
 
-        if details:
-            registry.logger.debug('Repo({}) Details({}) are fetched from cache.'.format(repo, details))
+        registry.logger.debug('Repo({}) Details({}) are fetched from cache.'.format(repo, details))
 
         return details
 
-    def update_downloads(self, repos):
-        """ Update the repositories downloads attribute in cache
+    def get_repos_details(self, repos):
+        """ Get the details of the repositories from the cache in one round trip.
+            Downloads are read from the repository entries, as by get_repo_details.
 
             Args:
-                repos (list): list of repository names.
+                repos (list): names of the repositories.
+
+            Returns:
+                dict: details of the cached repositories by name.
         """
+        found = {}
+        non_local_repos = []
+        for repo in repos:
+            details = self.local.get('repo', repo)
+            if details is local_cache.MISSING:
+                non_local_repos.append(repo)
+            elif details:
+                found[repo] = details
+
+        if not non_local_repos:
+            return found
+
+        keys = [self.delimiter.join([self.repos_key, repo]) for repo in non_local_repos]
         with self.client.pipeline() as pipe:
-            repos_to_update = []
-            labels_to_update = []
+            for key in keys:
+                pipe.hgetall(key)
+            for key in keys:
+                self.expire(pipe, key, 'repos')
+            results = pipe.execute()[:len(keys)]
 
-            for repo in repos:
-                # collect all the repos need to be updated
-                repo_item_key = self.delimiter.join([self.repos_key, repo])
-                if not pipe.exists(repo_item_key).execute()[0]:
+        for repo, fields in zip(non_local_repos, results):
+            if fields:
+                found[repo] = codec.decode_repo(repo, fields)
+                self.local.set('repo', repo, found[repo])
+
+        registry.logger.debug('Repos({}) details are fetched from cache.'.format(list(found)))
+
+        return found
+
+    def set_downloads(self, downloads):
+        """ Set the downloads of the cached repositories and their labels,
+            unless the cached ones are already greater.
+
+            Args:
+                downloads (dict): downloads by repository name.
+
+            Returns:
+                int: number of cached repositories.
+        """
+        if not downloads:
+            return 0
+
+        args = [
+            self.repos_key + self.delimiter,
+            self.labels_key + self.delimiter,
+            self.invalidation_channel,
+            json.dumps([('repos', None), ('repos_all', None)] + [('repo', repo) for repo in downloads]),
+        ]
+        for repo, repo_downloads in downloads.items():
+            args.extend([repo, int(repo_downloads)])
+
+        for repo in downloads:
+            self.local.invalidate('repo', repo)
+        self.local.invalidate('repos')
+        self.local.invalidate('repos_all')
+
+        return self.scripts.set_downloads(args=args)
+
+    def coalesce(self, tags, load):
+        """ Load the tags missing in cache once for all the workers of the cluster.
+
+            In-process workers wait for the green thread already filling a tag,
+            the first one per tag takes a short lived lock in redis and the workers
+            of other instances poll until the lock is released.
+
+            Args:
+                tags (list): list of tags missing in cache.
+                load (callable): loads the given tags from db and fills the cache,
+                                returns the loaded repositories.
+
+            Returns:
+                tuple: repositories loaded by this worker, tags filled by other workers
+                       (to be read from cache) and tags still not filled.
+        """
+        fill_lock = registry.config['CACHE']['FILL_LOCK']
+        token = uuid.uuid4().hex
+
+        # taking the in-process flights does not yield so it is atomic for green threads.
+        waiting = [(tag, self.flights[tag]) for tag in tags if tag in self.flights]
+        owned = [tag for tag in tags if tag not in self.flights]
+        for tag in owned:
+            self.flights[tag] = eventlet.event.Event()
+
+        lock_keys = {tag: self._lock_key(tag) for tag in owned}
+        leaders, followers = [], []
+        try:
+            with self.client.pipeline() as pipe:
+                for tag in owned:
+                    pipe.set(lock_keys[tag], token, nx=True, px=int(fill_lock['TIMEOUT'] * 1000))
+                for tag, locked in zip(owned, pipe.execute()):
+                    (leaders if locked else followers).append(tag)
+
+            repos = []
+            if leaders:
+                try:
+                    repos = load(leaders)
+                finally:
+                    self.scripts.release_locks(
+                        keys=[lock_keys[tag] for tag in leaders],
+                        args=[token]
+                    )
+
+            self._wait_fills(followers, lock_keys, fill_lock)
+        finally:
+            for tag in owned:
+                self.flights.pop(tag).send()
+
+        with eventlet.Timeout(fill_lock['TIMEOUT'], False):
+            for _, flight in waiting:
+                flight.wait()
+
+        others = [tag for tag, _ in waiting] + followers
+        with self.client.pipeline() as pipe:
+            for tag in others:
+                pipe.exists(self.delimiter.join([self.labels_key, tag]))
+            filled = pipe.execute() if others else []
+
+        filled_tags = [tag for tag, exists in zip(others, filled) if exists]
+        missing_tags = [tag for tag, exists in zip(others, filled) if not exists]
+
+        registry.logger.debug('Tags({}) loaded, Tags({}) filled by others, Tags({}) not filled.'.format(
+            leaders, filled_tags, missing_tags
+        ))
+
+        return repos, filled_tags, missing_tags
+
+    def _wait_fills(self, tags, lock_keys, fill_lock):
+        """ Poll until the other instances filling the tags release their lock.
+        """
+        deadline = time.time() + fill_lock['TIMEOUT']
+
+        while tags and time.time() < deadline:
+            time.sleep(fill_lock['POLL_INTERVAL'])
+
+            with self.client.pipeline() as pipe:
+                for tag in tags:
+                    pipe.exists(lock_keys[tag])
+                tags = [tag for tag, locked in zip(tags, pipe.execute()) if locked]
+
+    def _lock_key(self, tag):
+        return self.delimiter.join([self.cache_key, 'lock', 'labels', tag])
+
+    def buffer_popularity(self, tags):
+        """ Buffer the popularity increments of the tags until they are flushed to db.
+
+            Args:
+                tags (list): list of tags (repeated tags are counted each time).
+
+            Returns:
+                int: number of increments pending after this one.
+        """
+        with self.client.pipeline() as pipe:
+            for tag, count in collections.Counter(tags).items():
+                pipe.hincrby(self._buffer_key('popularity'), tag, count)
+            pipe.incrby(self._buffer_key('popularity', 'count'), len(tags))
+            return pipe.execute()[-1]
+
+    def pending_count(self, kind):
+        """ Get the number of increments pending in a buffer.
+
+            Args:
+                kind (str): buffer name e.g. popularity.
+
+            Returns:
+                int: number of pending increments.
+        """
+        return int(self.client.get(self._buffer_key(kind, 'count')) or 0)
+
+    def count_download(self, repo, seed=None):
+        """ Count a download of the repository in its running total and buffer
+            the increment until it is flushed to db, in a single atomic call.
+            Cached listings catch up with the new downloads on local cache expiry.
+
+            Args:
+                repo (str): repository name.
+
+            Kwargs:
+                seed (int): downloads in db, used when the total is not known yet.
+
+            Returns:
+                int: new downloads of the repository or None if total is unknown and no seed is given.
+        """
+        self.local.invalidate('repo', repo)
+
+        args = [
+            repo,
+            self.repos_key + self.delimiter,
+            self.labels_key + self.delimiter,
+            self.invalidation_channel,
+            json.dumps([('repo', repo)]),
+        ]
+        if seed is not None:
+            args.append(int(seed))
+
+        return self.scripts.count_download(
+            keys=[
+                self.delimiter.join([self.cache_key, 'downloads']),
+                self._buffer_key('downloads'),
+            ],
+            args=args,
+        )
+
+    def pop_batch(self, kind):
+        """ Move the pending increments of a buffer to a batch to be flushed.
+            The same batch is returned until it is acknowledged.
+
+            Args:
+                kind (str): buffer name e.g. popularity.
+
+            Returns:
+                tuple: pair of batch id and dict of increments, (None, {}) if nothing is pending.
+        """
+        batch = self.scripts.pop_batch(
+            keys=[
+                self._buffer_key(kind),
+                self._batch_key(kind),
+                self._batch_key(kind, 'id'),
+                self._buffer_key(kind, 'count'),
+            ],
+            args=[uuid.uuid4().hex],
+        )
+        if not batch:
+            return None, {}
+
+        batch_id, items = batch
+        return batch_id, {
+            name: int(count)
+            for name, count in zip(items[::2], items[1::2])
+        }
+
+    def ack_batch(self, kind, batch_id):
+        """ Acknowledge the batch once it is flushed.
+
+            Args:
+                kind (str): buffer name e.g. popularity.
+                batch_id (str): id of the flushed batch.
+
+            Returns:
+                bool: False if the batch was already acknowledged.
+        """
+        return bool(self.scripts.ack_batch(
+            keys=[self._batch_key(kind), self._batch_key(kind, 'id')],
+            args=[batch_id],
+        ))
+
+    def _buffer_key(self, kind, *parts):
+        return self.delimiter.join([self.cache_key, 'pending', kind] + list(parts))
+
+    def _batch_key(self, kind, *parts):
+        return self.delimiter.join([self.cache_key, 'flushing', kind] + list(parts))
+
+    def keyspace_report(self, count=1000, samples=100):
+        """ Report the key counts and memory used per keyspace, to size the cache.
+            Memory is estimated from a sample of keys of each keyspace.
+
+            Kwargs:
+                count (int): number of keys scanned per batch.
+                samples (int): number of keys sampled per keyspace for memory usage.
+
+            Returns:
+                dict: keyspaces details along with redis memory and eviction stats.
+        """
+        keyspaces = {
+            keyspace: {'keys': 0, 'bytes': 0, 'sampled': [], 'ttl': self.ttls.get(keyspace)}
+            for keyspace in ['tags', 'tags_index', 'labels', 'repos', 'pending', 'flushing', 'downloads']
+        }
+        prefix = self.cache_key + self.delimiter
+
+        cursor = 0
+        while True:
+            cursor, keys = self.client.scan(cursor, match=prefix + '*', count=count)
+            for key in keys:
+                keyspace = keyspaces.get(key[len(prefix):].split(self.delimiter, 1)[0])
+                if keyspace is None:
                     continue
-                repos_to_update.append(repo_item_key)
+                keyspace['keys'] += 1
+                if len(keyspace['sampled']) < samples:
+                    keyspace['sampled'].append(key)
+            if not int(cursor):
+                break
+
+        with self.client.pipeline(transaction=False) as pipe:
+            for keyspace in keyspaces.values():
+                for key in keyspace['sampled']:
+                    pipe.execute_command('MEMORY', 'USAGE', key)
+            # MEMORY USAGE needs redis >= 4, errors are counted as unknown (0).
+            usages = iter(pipe.execute(raise_on_error=False))
+
+        for keyspace in keyspaces.values():
+            sampled = keyspace.pop('sampled')
+            if sampled:
+                usage = [next(usages) for _ in sampled]
+                sample_bytes = sum(bytes_ for bytes_ in usage if isinstance(bytes_, int))
+                keyspace['bytes'] = int(sample_bytes * keyspace['keys'] / len(sampled))
+
+        memory = self.client.info('memory')
+        stats = self.client.info('stats')
+
+        report = {
+            'keyspaces': keyspaces,
+            'used_memory': memory.get('used_memory'),
+            'maxmemory': memory.get('maxmemory'),
+            'maxmemory_policy': memory.get('maxmemory_policy'),
+            'evicted_keys': stats.get('evicted_keys'),
+            'expired_keys': stats.get('expired_keys'),
+        }
+
+        registry.logger.info('Cache keyspace report: {}'.format(report))
+
+        return report
+
+    def migrate_repos(self, count=500):
+        """ Rewrite the legacy repository entries in the current encoding.
+            Safe to run concurrently, entries are checked before rewriting.
+
+            Kwargs:
+                count (int): number of keys scanned per batch.
+
+            Returns:
+                int: number of migrated repositories.
+        """
+        repos_prefix = self.repos_key + self.delimiter
+        migrated = 0
+        cursor = 0
+
+        with self.client.pipeline() as pipe:
+            while True:
+                cursor, keys = self.client.scan(cursor, match=repos_prefix + '*', count=count)
 
-                # collect all the labels need to be updated
-                labels = eval(pipe.hget(repo_item_key, 'tags').execute()[0])
-                for label in labels:
-                    label_item_key = self.delimiter.join([self.labels_key, label])
-                    if not pipe.exists(label_item_key).execute()[0]:
+                for key in keys:
+                    pipe.hgetall(key)
+
+                for key, fields in zip(keys, pipe.execute()):
+                    if not (fields and codec.is_legacy(fields)):
                         continue
-                    labels_to_update.append((label_item_key, repo))
 
-            # update  repos and labels
-            for repo_item in repos_to_update:
-                pipe.hincrby(repo_item, 'downloads', 1)
+                    details = codec.decode_repo(key[len(repos_prefix):], fields)
+                    pipe.delete(key)
+                    pipe.hmset(key, codec.encode_repo(details))
+                    self.expire(pipe, key, 'repos')
+                    migrated += 1
 
-            for label_item, repo in labels_to_update:
-                pipe.zincrby(label_item, repo, 1)
+                pipe.execute()
 
-            pipe.execute()
+                if not int(cursor):
+                    break
+
+        registry.logger.info('{} repos are migrated to cache encoding v{}.'.format(migrated, codec.VERSION))
+
+        return migrated
@@ -0,0 +1,189 @@
+""" Cache updater service applying the writes of the registry service to the cache.
+
+It runs in its own container so that cache maintenance is off the write path
+and updaters can be scaled apart from the registry service. Events carry absolute
+values and every cache write keeps the greatest downloads, so events can be
+applied more than once and in any order.
+"""
+# monkey paching should be first before nameko import.
+
+import eventlet
+eventlet.monkey_patch()
+
+import collections
+import json
+from eventlet import event
+from nameko import containers, events, extensions
+
+import base
+import registry
+
+from . import cache as _cache
+
+
+class Batch(object):
+    """ Cache updates of the events handled together.
+    """
+    def __init__(self):
+        self.tags = set()
+        self.repos = {}
+        self.downloads = {}
+        self.events = 0
+        self.done = event.Event()
+
+    def add(self, payload):
+        """ Merge the event payload in the batch.
+
+            Args:
+                payload (dict): tags, repos and/or downloads of the event.
+        """
+        self.tags.update(payload.get('tags', []))
+
+        for repo in payload.get('repos', []):
+            current = self.repos.get(repo['name'])
+            if current is None or (repo['downloads'] or 0) > (current['downloads'] or 0):
+                self.repos[repo['name']] = repo
+
+        for repo, downloads in payload.get('downloads', {}).items():
+            self.downloads[repo] = max(downloads, self.downloads.get(repo, 0))
+
+        self.events += 1
+
+    def apply(self, cache):
+        """ Apply the updates to the cache, tags first so that repositories can be labelled.
+
+            Args:
+                cache (RegistryCacheWrapper): cache the updates are applied to.
+        """
+        if self.tags:
+            # cached popularity of existing tags is kept.
+            cache.add_tags([(tag, 1) for tag in self.tags], nx=True)
+        if self.repos:
+            cache.update_repos(list(self.repos.values()))
+        if self.downloads:
+            cache.set_downloads(self.downloads)
+
+
+class CacheUpdates(extensions.DependencyProvider):
+    """ Group the updates of the concurrent workers in batches.
+
+        The first worker opens a batch and waits for others to join it,
+        then applies it while they wait for the outcome. So a message is
+        acknowledged only once its batch is in the cache.
+    """
+    # failed deliveries remembered per event, the oldest are forgotten past this size.
+    max_tracked = 10000
+
+    def setup(self):
+        self.batch = None
+        self.failures = collections.OrderedDict()
+
+    def get_dependency(self, worker_ctx):
+        return self.update
+
+    def update(self, cache, payload):
+        """ Apply the event payload to the cache. A failing event is requeued until it
+            has failed MAX_DELIVERIES times here, it is then logged and dropped.
+            Failures are counted in memory, they are counted whether redis is up or not.
+
+            Args:
+                cache (RegistryCacheWrapper): cache the updates are applied to.
+                payload (dict): id and tags, repos and/or downloads of the event.
+
+            Raises:
+                Exception: raised by the batch of the event, unless it is dropped.
+        """
+        key = payload.get('id') or json.dumps(payload, sort_keys=True)
+
+        try:
+            self.submit(cache, payload)
+        except Exception:
+            failures = self.failures.pop(key, 0) + 1
+            if failures < registry.config['CACHE_UPDATES']['MAX_DELIVERIES']:
+                self.failures[key] = failures
+                while len(self.failures) > self.max_tracked:
+                    self.failures.popitem(last=False)
+                raise
+
+            registry.logger.error(
+                'Cache updates of Event({}) dropped after {} deliveries.'.format(payload, failures),
+                exc_info=True
+            )
+        else:
+            self.failures.pop(key, None)
+
+    def submit(self, cache, payload):
+        """ Apply the event payload to the cache along with the concurrent ones.
+
+            Args:
+                cache (RegistryCacheWrapper): cache the updates are applied to.
+                payload (dict): tags, repos and/or downloads of the event.
+
+            Raises:
+                Exception: raised by the last attempt to apply the batch.
+        """
+        if self.batch is not None:
+            self.batch.add(payload)
+            return self.batch.done.wait()
+
+        batch = self.batch = Batch()
+        batch.add(payload)
+
+        config = registry.config['CACHE_UPDATES']
+        eventlet.sleep(config['BATCH_WINDOW'])
+        self.batch = None
+
+        delay = config['RETRY_DELAY']
+        for attempt in range(config['RETRIES'] + 1):
+            try:
+                batch.apply(cache)
+                break
+            except Exception as e:
+                registry.logger.warning(
+                    'Attempt {} to apply cache updates of {} events failed.'.format(attempt + 1, batch.events),
+                    exc_info=True
+                )
+                if attempt == config['RETRIES']:
+                    batch.done.send_exception(e)
+                    raise
+                eventlet.sleep(delay)
+                delay *= 2
+
+        registry.logger.info(
+            'Cache updated for {} events: Tags({}) Repos({}) Downloads({}).'.format(
+                batch.events, sorted(batch.tags), sorted(batch.repos), batch.downloads
+            )
+        )
+
+        batch.done.send(None)
+
+
+class CacheUpdaterService(base.BaseService):
+    name = '{}_cache_updater'.format(registry.service_name)
+    cache = _cache.RegistryCache()
+    updates = CacheUpdates()
+
+    # failed events are requeued, to be applied again by any updater up to MAX_DELIVERIES times.
+    @events.event_handler(registry.service_name, 'tags_added', requeue_on_error=True)
+    def tags_added(self, payload):
+        self.updates(self.cache, payload)
+
+    @events.event_handler(registry.service_name, 'repos_added', requeue_on_error=True)
+    def repos_added(self, payload):
+        self.updates(self.cache, payload)
+
+    @events.event_handler(registry.service_name, 'downloads_updated', requeue_on_error=True)
+    def downloads_updated(self, payload):
+        self.updates(self.cache, payload)
+
+
+def create_container():
+    # concurrent workers bound the size of the batches.
+    config = dict(registry.config, max_workers=registry.config['CACHE_UPDATES']['WORKERS'])
+    return containers.ServiceContainer(CacheUpdaterService, config=config)
+
+
+if __name__ == '__main__':
+    service_container = create_container()
+    service_container.start()
+    service_container.wait()
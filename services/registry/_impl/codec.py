@@ -0,0 +1,116 @@
+""" Encoding of the repository entries (repos:<name> hashes) in cache.
+
+Version 1 layout is a small hash, small enough to stay listpack encoded:
+
+    v: format version ('1')
+    d: description
+    u: uri
+    t: tags as a compact json array
+    n: downloads
+
+Name is not stored as it is already part of the key.
+Entries without a version field are the legacy layout (name, description,
+uri, downloads and tags as python repr of a list), they are still decoded
+(without eval) until they are migrated.
+"""
+
+import ast
+import json
+
+
+VERSION = '1'
+
+
+def encode_tags(tags):
+    """ Encode the tags of a repository.
+
+        Args:
+            tags (list): tag names.
+
+        Returns:
+            str: compact json array.
+    """
+    return json.dumps(list(tags), separators=(',', ':'))
+
+
+def decode_tags(value):
+    """ Decode the tags of a repository, legacy repr entries included.
+
+        Args:
+            value (str): encoded tags.
+
+        Returns:
+            list: tag names.
+    """
+    if value.startswith('['):
+        try:
+            return json.loads(value)
+        except ValueError:
+            pass
+    return list(ast.literal_eval(value))
+
+
+def encode_repo(repo):
+    """ Encode the repository details to its cache hash.
+
+        Args:
+            repo (dict): repository details (description, uri, tags and downloads).
+
+        Returns:
+            dict: hash fields for the repository.
+    """
+    return {
+        'v': VERSION,
+        'd': repo['description'] or '',
+        'u': repo['uri'] or '',
+        't': encode_tags(repo['tags']),
+        'n': int(repo.get('downloads') or 0),
+    }
+
+
+def decode_repo(name, fields, downloads=None):
+    """ Decode the repository cache hash to its details.
+
+        Args:
+            name (str): repository name.
+            fields (dict): hash fields for the repository.
+
+        Kwargs:
+            downloads (int): downloads overriding the one stored in hash.
+
+        Returns:
+            dict: repository details.
+    """
+    if is_legacy(fields):
+        details = {
+            'description': fields.get('description'),
+            'uri': fields.get('uri'),
+            'tags': decode_tags(fields.get('tags') or '[]'),
+            'downloads': fields.get('downloads'),
+        }
+    else:
+        details = {
+            'description': fields.get('d'),
+            'uri': fields.get('u'),
+            'tags': json.loads(fields.get('t') or '[]'),
+            'downloads': fields.get('n'),
+        }
+
+    if downloads is not None:
+        details['downloads'] = downloads
+    details['downloads'] = int(details['downloads'] or 0)
+    details['name'] = name
+
+    return details
+
+
+def is_legacy(fields):
+    """ Check whether the repository cache hash is in the legacy layout.
+
+        Args:
+            fields (dict): hash fields for the repository.
+
+        Returns:
+            bool: True if it needs migration.
+    """
+    return 'v' not in fields
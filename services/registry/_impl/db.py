@@ -1,120 +1,482 @@
 """ Utility module for all the database related queries.
 """
+import collections
+import datetime
+import functools
+import itertools
 import logging
+import math
+import time
+import weakref
 import nameko_sqlalchemy
-from . import models
+import sqlalchemy
+from sqlalchemy import exc, orm
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from . import migrations, models
 import registry
 
 
+def insert_ignore(session, table, rows):
+    """ Insert the rows in a single statement, skipping the ones
+        colliding with an existing row on a unique key.
+
+        Args:
+            session (Session): session executing the statement.
+            table (Table): table the rows are inserted in.
+            rows (list): list of rows (dict) to be inserted.
+
+        Returns:
+            ResultProxy: result of the statement.
+    """
+    dialect = session.get_bind().dialect.name
+
+    if dialect == 'mysql':
+        statement = mysql.insert(table).values(rows)
+        # no op update of the primary key (id = id), unlike INSERT IGNORE it keeps other errors.
+        key = table.primary_key.columns.values()[0].name
+        statement = statement.on_duplicate_key_update({key: table.c[key]})
+    elif dialect == 'sqlite':
+        statement = sqlite.insert(table).values(rows).on_conflict_do_nothing()
+    elif dialect == 'postgresql':
+        statement = postgresql.insert(table).values(rows).on_conflict_do_nothing()
+    else:
+        raise NotImplementedError('Upsert is not supported by {}.'.format(dialect))
+
+    return session.execute(statement)
+
+
+def reads(method):
+    """ Decorator running the read method with the session returned by reader,
+        passed as first argument. Read failing on a replica ejects it and is run again on the primary.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        session = self.reader()
+        try:
+            return method(self, session, *args, **kwargs)
+        except exc.OperationalError:
+            if session is self.session:
+                raise
+
+            self.fall_back(session)
+
+            return method(self, self.session, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter(object):
+    """ Routes the reads to the replicas in turn, leaving out the failing ones for a while.
+        It is shared by all the workers of the container.
+    """
+    def __init__(self, engines, staleness, eject_for):
+        self.engines = engines
+        self.staleness = staleness
+        self.eject_for = eject_for
+
+        self.turn = itertools.count()
+        self.ejected = {}
+        self.last_write = 0
+
+    def next_replica(self):
+        """ Next healthy replica.
+
+            Returns:
+                Engine: engine of the replica, None if all of them are ejected.
+        """
+        for _ in range(len(self.engines)):
+            engine = self.engines[next(self.turn) % len(self.engines)]
+            if self.ejected.get(engine, 0) < time.time():
+                return engine
+
+    def eject(self, engine):
+        """ Leave the replica out of the rotation for eject_for seconds.
+        """
+        self.ejected[engine] = time.time() + self.eject_for
+        registry.logger.error('Replica({}) ejected for {}s.'.format(engine.url, self.eject_for))
+
+    def written(self):
+        """ Record a write to the primary.
+        """
+        self.last_write = time.time()
+
+    def is_stale(self):
+        """ Replicas may not have caught up with a write made less than staleness seconds ago.
+        """
+        return time.time() - self.last_write < self.staleness
+
+    def dispose(self):
+        for engine in self.engines:
+            engine.dispose()
+
+
 class RegistryDatabaseSession(nameko_sqlalchemy.Session):
     """ Class to create the db session for trasactions.
+        Reads are routed to the replicas of DB_REPLICA_URIS if any.
     """
     def setup(self):
-        """ Method to setup the db i.e. create all componenets of it.
+        """ Method to setup the db i.e. migrate it to the latest schema.
         """
         super().setup()
-        self.declarative_base.metadata.create_all(self.engine)
+        migrations.upgrade(self.engine)
+
+        uri_key = '{}:{}'.format(self.container.service_name, self.declarative_base.__name__)
+        uris = (registry.config.get('DB_REPLICA_URIS') or {}).get(uri_key) or []
+        replicas = registry.config['REPLICAS']
+
+        self.router = ReplicaRouter(
+            [sqlalchemy.create_engine(uri) for uri in uris],
+            replicas['STALENESS'],
+            replicas['EJECT_FOR']
+        ) if uris else None
+        self.wrappers = weakref.WeakKeyDictionary()
+
+    def stop(self):
+        if self.router:
+            self.router.dispose()
+        super().stop()
 
     def get_dependency(self, worker_ctx):
         session = super().get_dependency(worker_ctx)
-        return RegistryDatabaseSessionWrapper(session)
+        wrapper = RegistryDatabaseSessionWrapper(session, self.router)
+        self.wrappers[worker_ctx] = wrapper
+        return wrapper
+
+    def worker_teardown(self, worker_ctx):
+        wrapper = self.wrappers.pop(worker_ctx, None)
+        if wrapper:
+            wrapper.close()
+        super().worker_teardown(worker_ctx)
 
 
 class RegistryDatabaseSessionWrapper(object):
-    """ Wrapper around RegistryDatabase for all db operations
+    """ Wrapper around RegistryDatabase for all db operations.
+        Read methods (reads decorator) are given the session to read with.
     """
-    def __init__(self, session):
+    def __init__(self, session, router=None):
         self.session = session
+        self.router = router
+        self.read_session = None
+        self.wrote = False
+
+        if router:
+            sqlalchemy.event.listen(session, 'after_commit', self._written)
+
+    def _written(self, session):
+        self.wrote = True
+        self.router.written()
+
+    def reader(self):
+        """ Session of the reads, a replica unless the worker (read after write)
+            or the container wrote recently, or no replica is healthy.
+
+            Returns:
+                Session: session of a replica or the primary one.
+        """
+        if self.router is None or self.wrote or self.router.is_stale():
+            return self.session
+
+        if self.read_session is None:
+            engine = self.router.next_replica()
+            if engine is None:
+                return self.session
+            self.read_session = orm.Session(bind=engine)
+
+        return self.read_session
+
+    def fall_back(self, session):
+        """ Eject the replica of the failed read session, reads go on with the primary one.
+
+            Args:
+                session (Session): replica session the read failed with.
+        """
+        registry.logger.warning('Read failed on replica, falling back to primary.', exc_info=True)
+        self.router.eject(session.get_bind())
+        self.close()
+
+    def close(self):
+        """ Close the replica session of the worker.
+        """
+        if self.read_session is not None:
+            self.read_session.close()
+            self.read_session = None
 
     def add_tags(self, tags):
-        """ Add the tags to the db.
+        """ Add the tags to the db in a single statement,
+            existing tags are left as they are.
 
             Args:
                 tags (list): list of tags to be added in db.
         """
-        tag_objs = [models.Tag(name=tag, popularity=1) for tag in tags]
-        self.session.add_all(tag_objs)
+        if not tags:
+            return
+
+        insert_ignore(
+            self.session,
+            models.Tag.__table__,
+            [{'name': tag, 'popularity': 1} for tag in set(tags)]
+        )
         self.session.commit()
 
-        registry.logger.debug('Tags() are added to db.'.format(tags))
+        registry.logger.debug('Tags({}) are added to db.'.format(tags))
 
     def update_popularity(self, tags):
-        """ Update the given tags popularity.
+        """ Update the given tags popularity in a single update.
+
+            Args:
+                tags (list): list of tags to be updated, a tag is counted once per occurrence.
+        """
+        self._increment_popularity(collections.Counter(tags))
+        self.session.commit()
+
+    def apply_popularity(self, batch_id, tag_counts):
+        """ Apply a buffered batch of popularity increments.
+            A batch is applied only once, whatever the number of calls.
 
             Args:
-                tags (list): list of tags to be updated.
+                batch_id (str): id of the batch.
+                tag_counts (dict): increments per tag name.
+
+            Returns:
+                bool: False if the batch was already applied.
         """
-        tag_counts = {}
-        for tag in tags:
-            if tag not in tag_counts.keys():
-                tag_counts[tag] = tags.count(tag)
+        if not self._log_flush(batch_id, 'popularity'):
+            return False
 
-        tags = self.session.query(models.Tag)\
+        self._increment_popularity(tag_counts)
+
+        return self._commit_flush(batch_id)
+
+    def _increment_popularity(self, tag_counts):
+        """ Increment the popularity of the tags in the current transaction,
+            with a single UPDATE ... SET popularity = popularity + CASE name ... END.
+
+            Args:
+                tag_counts (dict): increments per tag name.
+        """
+        if not tag_counts:
+            return
+
+        popularity = sqlalchemy.func.coalesce(models.Tag.popularity, 0)
+        self.session.query(models.Tag)\
             .filter(models.Tag.name.in_(tag_counts.keys()))\
-            .all()
+            .update(
+                {
+                    models.Tag.popularity: popularity + sqlalchemy.case(
+                        tag_counts,
+                        value=models.Tag.name,
+                        else_=0
+                    )
+                },
+                synchronize_session=False
+            )
 
-        for tag in tags:
-            tag.popularity = models.Tag.popularity + tag_counts[tag.name]
+    def _log_flush(self, batch_id, kind, retention=86400):
+        """ Log the batch in the flush table of current transaction.
 
-        self.session.commit()
+            Args:
+                batch_id (str): id of the batch.
+                kind (str): buffer name e.g. popularity.
+
+            Kwargs:
+                retention (int): seconds flushes are kept in the log.
 
-    def get_tags(self, tags=None):
+            Returns:
+                bool: False if the batch was already applied.
+        """
+        if self.session.query(models.Flush).get(batch_id):
+            registry.logger.info('Batch({}) is already applied.'.format(batch_id))
+            return False
+
+        expired = datetime.datetime.utcnow() - datetime.timedelta(seconds=retention)
+        self.session.query(models.Flush)\
+            .filter(models.Flush.created < expired)\
+            .delete(synchronize_session=False)
+
+        # logged before the batch is applied, so that a concurrent flusher of the same
+        # batch fails here rather than on the autoflush of the update.
+        self.session.add(models.Flush(batch_id=batch_id, kind=kind))
+        try:
+            self.session.flush()
+        except exc.IntegrityError:
+            self.session.rollback()
+            registry.logger.info('Batch({}) is already applied.'.format(batch_id))
+            return False
+
+        return True
+
+    def _commit_flush(self, batch_id):
+        """ Commit the transaction applying the batch.
+
+            Args:
+                batch_id (str): id of the batch.
+
+            Returns:
+                bool: False if the batch was concurrently applied.
+        """
+        try:
+            self.session.commit()
+        except exc.IntegrityError:
+            self.session.rollback()
+            registry.logger.info('Batch({}) is already applied.'.format(batch_id))
+            return False
+
+        registry.logger.debug('Batch({}) is applied to db.'.format(batch_id))
+        return True
+
+    @reads
+    def get_tags(self, session, tags=None, limit=None):
         """ Get the tags from the db.
 
             Args:
                 tags (list): list of tags to be fetched from in db.
                             None means fetch all tags.
 
+            Kwargs:
+                limit (int): maximum number of the most popular tags fetched.
+
             Returns:
                 (list): list of tags details fetched from db.
         """
         tags = tags or []
-        tag_objs = []
+        query = session.query(models.Tag)
 
         if tags:
-            tag_objs = self.session.query(models.Tag)\
-                .filter(models.Tag.name.in_(tags))\
-                .order_by(models.Tag.popularity.desc())\
-                .all()
-        else:
-            tag_objs = self.session.query(models.Tag)\
-                .order_by(models.Tag.popularity.desc())\
-                .all()
+            query = query.filter(models.Tag.name.in_(tags))
+
+        query = query.order_by(models.Tag.popularity.desc())
+
+        if limit:
+            query = query.limit(limit)
+
+        tag_objs = query.all()
 
         tag_names = [tag.name for tag in tag_objs]
         registry.logger.debug('Tags({}) are fetched from db.'.format(tag_names))
 
         return tag_objs
 
-    def add_repos(self, repos):
-        """ Add the given repositores to the db.
+    @reads
+    def complete_tags(self, session, prefix, limit):
+        """ Get the most popular tags starting with the prefix (case insensitive) from the db.
 
             Args:
-                repos (list): list of repositories need to be updated in the db.
+                prefix (str): prefix of the tag names.
+                limit (int): maximum number of tags.
+
+            Returns:
+                (list): list of tags details fetched from db.
         """
+        tag_objs = session.query(models.Tag) \
+            .filter(sqlalchemy.func.lower(models.Tag.name).startswith(prefix.lower(), autoescape=True)) \
+            .order_by(models.Tag.popularity.desc(), models.Tag.name) \
+            .limit(limit) \
+            .all()
 
-        added_repos = []
+        registry.logger.debug(
+            'Tags({}) are completed from db for Prefix({}).'.format([tag.name for tag in tag_objs], prefix)
+        )
 
-        for repo in repos:
-            repo_obj = models.Repository(
-                name=repo['name'],
-                description=repo['description'],
-                uri=repo['uri']
-            )
-            self.session.add(repo_obj)
+        return tag_objs
 
-            for tag in repo['tags']:
-                tag = self.session.query(models.Tag)\
-                        .filter(models.Tag.name == tag)\
-                        .first()
-                repo_obj.labels.append(tag)
+    @reads
+    def get_tag_names(self, session):
+        """ Get the names of all the tags from the db.
 
-            added_repos.append(repo_obj)
+            Returns:
+                (list): list of tag names.
+        """
+        return [name for name, in session.query(models.Tag.name)]
 
-        self.session.commit()
+    def add_repos(self, repos, chunk_size=None):
+        """ Add the given repositores to the db in bulk.
+            Tag ids are resolved in one query, repositories and their labels
+            are inserted with multi-row inserts in one transaction per chunk.
+            Existing repositories and labels are left as they are.
 
-        repo_names = [repo.name for repo in added_repos]
-        registry.logger.debug('Repos({}) are added to db.'.format(repo_names))
+            Args:
+                repos (list): list of repositories need to be updated in the db.
+
+            Kwargs:
+                chunk_size (int): repositories inserted per transaction.
+
+            Returns:
+                list: of added repositories (dict).
+        """
+        chunk_size = chunk_size or registry.config['INGEST']['CHUNK_SIZE']
+        start = time.time()
+
+        tag_names = {tag for repo in repos for tag in repo['tags']}
+        tag_ids = dict(
+            self.session.query(models.Tag.name, models.Tag.id_)
+            .filter(models.Tag.name.in_(tag_names))
+        ) if tag_names else {}
+
+        added_repos, rows = [], 0
+
+        for index in range(0, len(repos), chunk_size):
+            chunk = [
+                {
+                    'name': repo['name'],
+                    'description': repo['description'],
+                    'uri': repo['uri'],
+                    'downloads': 0,
+                    'tags': [tag for tag in repo['tags'] if tag in tag_ids]
+                }
+                for repo in repos[index:index + chunk_size]
+            ]
+
+            # existing repositories are left out, along with their labels.
+            names = {repo['name']: repo for repo in chunk}
+            for name, in self.session.query(models.Repository.name)\
+                    .filter(models.Repository.name.in_(names.keys())):
+                del names[name]
+
+            if names:
+                insert_ignore(
+                    self.session,
+                    models.Repository.__table__,
+                    [
+                        {key: repo[key] for key in ('name', 'description', 'uri', 'downloads')}
+                        for repo in names.values()
+                    ]
+                )
+
+            # details are read back, as stored by db.
+            repo_ids = {}
+            for row in self.session.query(
+                    models.Repository.name, models.Repository.id_, models.Repository.description,
+                    models.Repository.uri, models.Repository.downloads)\
+                    .filter(models.Repository.name.in_(names.keys())):
+                repo_ids[row.name] = row.id_
+                names[row.name].update(
+                    description=row.description,
+                    uri=row.uri,
+                    downloads=row.downloads or 0
+                )
+
+            # a repository colliding on its uri only is not added.
+            chunk = [repo for repo in names.values() if repo['name'] in repo_ids]
+
+            labels = [
+                {'repo_id': repo_ids[repo['name']], 'tag_id': tag_ids[tag]}
+                for repo in chunk
+                for tag in repo['tags']
+            ]
+            if labels:
+                insert_ignore(self.session, models.repositories_tags, labels)
+
+            self.session.commit()
+
+            added_repos.extend(chunk)
+            rows += len(chunk) + len(labels)
+
+        duration = time.time() - start
+        registry.logger.info(
+            'Repos({}) are added to db with {} rows in {:.3f}s ({:.0f} rows/s).'.format(
+                len(added_repos), rows, duration, rows / duration if duration else rows
+            )
+        )
+        registry.logger.debug('Repos({}) are added to db.'.format([repo['name'] for repo in added_repos]))
 
         return added_repos
 
@@ -131,42 +493,287 @@ class RegistryDatabaseSessionWrapper(object):
             repo.downloads = models.Repository.downloads + 1
         self.session.commit()
 
-    def get_repos_from_tags(self, tags=None):
+    def apply_downloads(self, batch_id, repo_counts):
+        """ Apply a buffered batch of download increments in a single update.
+            A batch is applied only once, whatever the number of calls.
+
+            Args:
+                batch_id (str): id of the batch.
+                repo_counts (dict): increments per repository name.
+
+            Returns:
+                bool: False if the batch was already applied.
+        """
+        if not self._log_flush(batch_id, 'downloads'):
+            return False
+
+        downloads = sqlalchemy.func.coalesce(models.Repository.downloads, 0)
+        self.session.query(models.Repository)\
+            .filter(models.Repository.name.in_(repo_counts.keys()))\
+            .update(
+                {
+                    models.Repository.downloads: downloads + sqlalchemy.case(
+                        repo_counts,
+                        value=models.Repository.name,
+                        else_=0
+                    )
+                },
+                synchronize_session=False
+            )
+
+        return self._commit_flush(batch_id)
+
+    def get_repos_from_tags(self, tags=None, match='any', limit=None, cursor=None):
         """ Fetch repositores for the given tags.
 
             Args:
                 tags (list): repositores will be fetched based on these given tags.
 
+            Kwargs:
+                match (str): 'any' for repositories having any of the tags,
+                            'all' for repositories having all of them.
+                limit (int): maximum number of repositories fetched, None means all of them.
+                cursor (list): (downloads, name) of the last repository of the previous page,
+                            only the repositories ranked after it are fetched.
+
             Returns:
-                list: of repositories fetched from db.
+                list: of repositories (dict) fetched from db, ranked by downloads then name.
         """
-        if not tags:
-            return self.session.query(models.Repository)\
-                .order_by(models.Repository.downloads.desc())\
-                .all()
+        repos = list(self.iter_repos_from_tags(tags, match, limit, cursor))
 
-        tag_ids = [tag.id_ for tag in self.get_tags(tags)]
-        repos = self.session.query(models.Repository)\
-            .filter(models.Repository.labels.any(
-                models.Tag.id_.in_(tag_ids)))\
-            .order_by(models.Repository.downloads.desc())\
-            .all()
+        repo_names = [repo['name'] for repo in repos]
+        registry.logger.debug('Repos({}) are fetched from db for {} Tags({}).'.format(repo_names, match, tags))
 
-        repo_names = [repo.name for repo in repos]
-        registry.logger.debug('Repos({}) are fetched from db for Tags({}).'.format(repo_names, tags))
+        return repos
+
+    @reads
+    def iter_repos_from_tags(self, session, tags=None, match='any', limit=None, cursor=None, chunk_size=1000):
+        """ Stream repositores for the given tags, read with core selects (no ORM objects).
+            Rows are fetched by chunks, each one with a single query for the tags of its repositories.
+
+            Args:
+                tags (list): repositores will be fetched based on these given tags.
+
+            Kwargs:
+                match (str): 'any' for repositories having any of the tags,
+                            'all' for repositories having all of them.
+                limit (int): maximum number of repositories fetched, None means all of them.
+                cursor (list): (downloads, name) of the last repository of the previous page.
+                chunk_size (int): rows fetched at a time.
+
+            Returns:
+                iterator: of repositories (dict), ranked by downloads then name.
+        """
+        repositories = models.Repository.__table__
+        labels = models.repositories_tags
+        statement = repositories.select()
+
+        if tags:
+            tag_ids = [tag.id_ for tag in self.get_tags(tags)]
+
+            if match == 'all':
+                # an unknown tag can't be had by any repository.
+                if len(tag_ids) < len(set(tags)):
+                    return iter([])
+
+                repo_ids = session.query(labels.c.repo_id)\
+                    .filter(labels.c.tag_id.in_(tag_ids))\
+                    .group_by(labels.c.repo_id)\
+                    .having(sqlalchemy.func.count(sqlalchemy.distinct(labels.c.tag_id)) == len(tag_ids))
+                statement = statement.where(repositories.c.id_.in_(repo_ids))
+            else:
+                statement = statement.where(sqlalchemy.exists().where(sqlalchemy.and_(
+                    labels.c.repo_id == repositories.c.id_,
+                    labels.c.tag_id.in_(tag_ids)
+                )))
+
+        return self._stream(session, functools.partial(self._page, statement), limit, cursor, chunk_size)
+
+    def _stream(self, session, page, limit, cursor, chunk_size):
+        """ Stream the repositories of the page by chunks. Chunks are fetched after
+            the read method returned, a replica failing meanwhile is ejected and
+            the rest of the page is read from the primary, after the last streamed repository.
+        """
+        streamed = 0
+        try:
+            result = session.execute(page(limit, cursor))
+
+            # rows are buffered by the driver, a server side cursor would forbid the tags queries.
+            rows = result.fetchmany(chunk_size)
+            while rows:
+                for repo in self._with_tags(session, rows):
+                    streamed += 1
+                    cursor = (repo['downloads'], repo['name'])
+                    yield repo
+                rows = result.fetchmany(chunk_size)
+        except exc.OperationalError:
+            if session is self.session:
+                raise
+
+            self.fall_back(session)
+
+            if not limit or streamed < limit:
+                for repo in self._stream(self.session, page, limit and limit - streamed, cursor, chunk_size):
+                    yield repo
+
+    def _page(self, statement, limit, cursor):
+        """ Rank the repositories select and keep the page after the cursor (keyset pagination).
+            Names are unique so (downloads, name) is a total order, same as the cache labels,
+            read in the order of the downloads index.
+        """
+        repositories = models.Repository.__table__
+        downloads = repositories.c.downloads
+
+        if cursor:
+            cursor_downloads, cursor_name = cursor
+            statement = statement.where(sqlalchemy.or_(
+                downloads < cursor_downloads,
+                sqlalchemy.and_(
+                    downloads == cursor_downloads,
+                    repositories.c.name < cursor_name
+                )
+            ))
+
+        statement = statement.order_by(downloads.desc(), repositories.c.name.desc())
+
+        if limit:
+            statement = statement.limit(limit)
+
+        return statement
+
+    def _with_tags(self, session, rows):
+        """ Turn the repository rows into dicts with their tag names, fetched in one query.
+
+            Args:
+                session (Session): session the rows are read with.
+                rows (list): rows of the repositories table.
+
+            Returns:
+                list: of repositories (dict).
+        """
+        tags = collections.defaultdict(list)
+
+        if rows:
+            labels = models.repositories_tags
+            statement = labels.join(models.Tag.__table__).select()\
+                .where(labels.c.repo_id.in_([row.id_ for row in rows]))
+            for label in session.execute(statement):
+                tags[label.repo_id].append(label.name)
+
+        return [
+            {
+                'name': row.name,
+                'description': row.description,
+                'downloads': row.downloads,
+                'uri': row.uri,
+                'tags': tags[row.id_]
+            }
+            for row in rows
+        ]
+
+    @reads
+    def search_repos(self, session, query, limit=20, candidates=1000):
+        """ Search the repositories by name and description,
+            ranked by relevance times the log of the downloads.
+
+            Full text index is used on mysql, other dbs fall back to LIKE matching
+            of each word of the query, relevance being the number of words matched.
+
+            Args:
+                query (str): words to search for.
+
+            Kwargs:
+                limit (int): maximum number of repositories returned.
+                candidates (int): most downloaded repositories ranked by the fallback.
+
+            Returns:
+                list: of repositories (dict) with their score.
+        """
+        words = query.split()
+        if not words:
+            return []
+
+        if session.get_bind().dialect.name == 'mysql':
+            rows = session.execute(
+                sqlalchemy.text(
+                    'SELECT id_, name, description, downloads, uri, '
+                    'MATCH (name, description) AGAINST (:query IN NATURAL LANGUAGE MODE) '
+                    '* LOG(2 + downloads) AS score '
+                    'FROM repositories '
+                    'WHERE MATCH (name, description) AGAINST (:query IN NATURAL LANGUAGE MODE) '
+                    'ORDER BY score DESC, name DESC '
+                    'LIMIT :limit'
+                ),
+                {'query': query, 'limit': limit}
+            ).fetchall()
+            scores = [row.score for row in rows]
+        else:
+            repositories = models.Repository.__table__
+            columns = [sqlalchemy.func.lower(repositories.c.name), sqlalchemy.func.lower(repositories.c.description)]
+            matches = [
+                sqlalchemy.or_(*[column.contains(word.lower(), autoescape=True) for column in columns])
+                for word in words
+            ]
+            rows = session.execute(
+                repositories.select()
+                .where(sqlalchemy.or_(*matches))
+                .order_by(repositories.c.downloads.desc(), repositories.c.name.desc())
+                .limit(candidates)
+            ).fetchall()
+
+            def score(row):
+                text = '{} {}'.format(row.name, row.description or '').lower()
+                relevance = sum(word.lower() in text for word in words)
+                return relevance * math.log(2 + row.downloads)
+
+            ranked = sorted(((score(row), row) for row in rows), key=lambda item: item[0], reverse=True)[:limit]
+            scores = [item[0] for item in ranked]
+            rows = [item[1] for item in ranked]
+
+        repos = self._with_tags(session, rows)
+        for repo, score in zip(repos, scores):
+            repo['score'] = float(score)
+
+        registry.logger.debug('Repos({}) are found in db for Query({}).'.format(
+            [repo['name'] for repo in repos], query
+        ))
 
         return repos
 
-    def get_repo_details(self, repo):
+    @reads
+    def get_repo_details(self, session, repo):
         """ Get detail for the given repository.
 
             Args:
                 repo (str): repository name for which details will be fetched.
 
             Returns:
-                (dict): details for the given repository.
+                (dict): details for the given repository, None if it doesn't exist.
 
         """
-        return self.session.query(models.Repository)\
-            .filter(models.Repository.name == repo)\
-            .first()
+        repositories = models.Repository.__table__
+        row = session.execute(
+            repositories.select().where(repositories.c.name == repo)
+        ).first()
+
+        return self._with_tags(session, [row])[0] if row else None
+
+    @reads
+    def get_repos_by_name(self, session, repos):
+        """ Get the details of the given repositories with a single query.
+
+            Args:
+                repos (list): names of the repositories.
+
+            Returns:
+                (list): details of the existing repositories, in no particular order.
+        """
+        if not repos:
+            return []
+
+        repositories = models.Repository.__table__
+        rows = session.execute(
+            repositories.select().where(repositories.c.name.in_(repos))
+        ).fetchall()
+
+        return self._with_tags(session, rows)
@@ -0,0 +1,17 @@
+""" Custom entrypoints for the service.
+"""
+
+from nameko import extensions
+
+
+class Once(extensions.Entrypoint):
+    """ Entrypoint running the decorated method once, when the container starts.
+    """
+    def start(self):
+        self.container.spawn_managed_thread(self.run)
+
+    def run(self):
+        self.container.spawn_worker(self, (), {})
+
+
+once = Once.decorator
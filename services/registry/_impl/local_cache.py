@@ -0,0 +1,98 @@
+""" In-process cache sitting in front of redis.
+"""
+
+import collections
+import time
+
+
+MISSING = object()
+
+
+class LocalCache(object):
+    """ Bounded LRU cache with a time to live for its entries.
+
+        Entries are keyed by (namespace, name) pairs so that a whole namespace
+        or a single entry can be invalidated. It is shared by all the workers
+        (green threads) of a container, values must not be mutated by callers.
+    """
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, namespace, name):
+        """ Get the value of the entry.
+
+            Args:
+                namespace (str): namespace of the entry.
+                name (hashable): name of the entry in its namespace.
+
+            Returns:
+                value of the entry or MISSING.
+        """
+        key = (namespace, name)
+        entry = self.entries.get(key)
+
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return MISSING
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, namespace, name, value):
+        """ Set the value of the entry, evicting the least recently used one if full.
+
+            Args:
+                namespace (str): namespace of the entry.
+                name (hashable): name of the entry in its namespace.
+                value: value of the entry.
+        """
+        key = (namespace, name)
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, namespace, name=None):
+        """ Invalidate the entry or all the entries of the namespace.
+
+            Args:
+                namespace (str): namespace of the entries.
+
+            Kwargs:
+                name (hashable): name of the entry, None means the whole namespace.
+        """
+        if name is not None:
+            self.entries.pop((namespace, name), None)
+            return
+
+        for key in [key for key in self.entries if key[0] == namespace]:
+            del self.entries[key]
+
+    def clear(self):
+        """ Invalidate all the entries.
+        """
+        self.entries.clear()
+
+    def stats(self):
+        """ Statistics of the cache.
+
+            Returns:
+                dict: hits, misses, evictions and current size.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self.entries),
+        }
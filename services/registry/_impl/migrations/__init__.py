@@ -0,0 +1,63 @@
+""" Versioned migrations of the registry db, run with alembic.
+"""
+
+import os
+from alembic import command, config as alembic_config
+import sqlalchemy
+import registry
+
+
+# revision matching the schema of the dbs created before the migrations.
+BASELINE = '0001'
+
+
+def get_config(connection=None):
+    """ Alembic config of the registry migrations.
+
+        Kwargs:
+            connection (Connection): connection the migrations run on,
+                                    None means the registry db uri.
+
+        Returns:
+            Config: alembic config.
+    """
+    config = alembic_config.Config()
+    config.set_main_option('script_location', os.path.dirname(__file__))
+    config.set_main_option('sqlalchemy.url', registry.config['DB_URIS']['registry:Base'].replace('%', '%%'))
+    config.attributes['connection'] = connection
+    return config
+
+
+def upgrade(engine, revision='head'):
+    """ Upgrade the db to the revision.
+        A db created before the migrations (without version table) is stamped
+        with the baseline first, so that only the later revisions are run.
+
+        Args:
+            engine (Engine): engine of the db.
+
+        Kwargs:
+            revision (str): target revision.
+    """
+    with engine.connect() as connection:
+        # instances of the service starting together migrate one at a time.
+        if engine.dialect.name == 'mysql':
+            connection.execute(sqlalchemy.text("SELECT GET_LOCK('registry_migrations', 60)"))
+
+        try:
+            config = get_config(connection)
+            tables = sqlalchemy.inspect(connection).get_table_names()
+
+            if 'alembic_version' not in tables and 'repositories' in tables:
+                registry.logger.info('Db without version is stamped with Revision({}).'.format(BASELINE))
+                command.stamp(config, BASELINE)
+
+            command.upgrade(config, revision)
+        finally:
+            if engine.dialect.name == 'mysql':
+                connection.execute(sqlalchemy.text("SELECT RELEASE_LOCK('registry_migrations')"))
+
+        if hasattr(connection, 'commit'):
+            connection.commit()
+
+    registry.logger.info('Db is upgraded to Revision({}).'.format(revision))
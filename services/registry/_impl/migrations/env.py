@@ -0,0 +1,49 @@
+""" Alembic environment of the registry migrations.
+"""
+
+from alembic import context
+import sqlalchemy
+
+from registry._impl import models
+
+
+config = context.config
+target_metadata = models.DeclarativeBase.metadata
+
+
+def run_migrations(connection):
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        # sqlite can't alter columns, tables are copied instead.
+        render_as_batch=connection.dialect.name == 'sqlite'
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_offline():
+    context.configure(
+        url=config.get_main_option('sqlalchemy.url'),
+        target_metadata=target_metadata,
+        literal_binds=True
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    connection = config.attributes.get('connection')
+    if connection is not None:
+        run_migrations(connection)
+        return
+
+    engine = sqlalchemy.create_engine(config.get_main_option('sqlalchemy.url'))
+    with engine.connect() as connection:
+        run_migrations(connection)
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
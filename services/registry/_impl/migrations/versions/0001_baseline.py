@@ -0,0 +1,43 @@
+""" Baseline, tables as created before the migrations (mysql/registry.sql).
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'tags',
+        sqlalchemy.Column('id_', sqlalchemy.Integer, primary_key=True),
+        sqlalchemy.Column('name', sqlalchemy.String(30), unique=True),
+        sqlalchemy.Column('popularity', sqlalchemy.Integer),
+    )
+    op.create_table(
+        'repositories',
+        sqlalchemy.Column('id_', sqlalchemy.Integer, primary_key=True),
+        sqlalchemy.Column('name', sqlalchemy.String(100), unique=True),
+        sqlalchemy.Column('description', sqlalchemy.String(500)),
+        sqlalchemy.Column('downloads', sqlalchemy.Integer),
+        sqlalchemy.Column('uri', sqlalchemy.String(500), unique=True),
+    )
+    op.create_table(
+        'repositories_tags',
+        sqlalchemy.Column('tag_id', sqlalchemy.Integer, sqlalchemy.ForeignKey('tags.id_'), index=True),
+        sqlalchemy.Column('repo_id', sqlalchemy.Integer, sqlalchemy.ForeignKey('repositories.id_'), index=True),
+    )
+
+
+def downgrade():
+    op.drop_table('repositories_tags')
+    op.drop_table('repositories')
+    op.drop_table('tags')
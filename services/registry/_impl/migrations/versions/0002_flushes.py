@@ -0,0 +1,32 @@
+""" Log of the buffered batches applied to the db.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # dbs set up by create_all have it already.
+    if 'flushes' in sqlalchemy.inspect(op.get_bind()).get_table_names():
+        return
+
+    op.create_table(
+        'flushes',
+        sqlalchemy.Column('batch_id', sqlalchemy.String(32), primary_key=True),
+        sqlalchemy.Column('kind', sqlalchemy.String(30)),
+        sqlalchemy.Column('created', sqlalchemy.DateTime),
+    )
+
+
+def downgrade():
+    op.drop_table('flushes')
@@ -0,0 +1,108 @@
+""" Indexes of the listings and primary key of the repositories tags.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+# sqlite tables are copied to alter them, their unique columns are declared
+# again as inline unique constraints are not always reflected.
+UNIQUE_COLUMNS = {
+    'repositories': ['name', 'uri'],
+    'tags': ['name'],
+}
+
+
+def _batch_alter_table(table):
+    return op.batch_alter_table(table, table_args=[
+        sqlalchemy.UniqueConstraint(column, name='uq_{}_{}'.format(table, column))
+        for column in UNIQUE_COLUMNS[table]
+    ])
+
+
+def _not_null(table, column):
+    """ Replace the nulls by 0 and make the column not nullable, so that it can be ranked by its index.
+    """
+    op.execute(
+        sqlalchemy.table(table, sqlalchemy.column(column))
+        .update()
+        .where(sqlalchemy.column(column).is_(None))
+        .values({column: 0})
+    )
+    with _batch_alter_table(table) as batch:
+        batch.alter_column(
+            column,
+            existing_type=sqlalchemy.Integer,
+            nullable=False,
+            server_default='0'
+        )
+
+
+def upgrade():
+    _not_null('repositories', 'downloads')
+    _not_null('tags', 'popularity')
+
+    op.create_index(
+        'ix_repositories_downloads_name',
+        'repositories',
+        [sqlalchemy.text('downloads DESC'), sqlalchemy.text('name DESC')]
+    )
+    op.create_index('ix_tags_popularity', 'tags', [sqlalchemy.text('popularity DESC')])
+
+    # a primary key can't be added over duplicated or null rows, the table is copied without them.
+    op.create_table(
+        'repositories_tags_new',
+        sqlalchemy.Column(
+            'tag_id',
+            sqlalchemy.Integer,
+            sqlalchemy.ForeignKey('tags.id_', name='fk_repositories_tags_tag_id'),
+            primary_key=True
+        ),
+        sqlalchemy.Column(
+            'repo_id',
+            sqlalchemy.Integer,
+            sqlalchemy.ForeignKey('repositories.id_', name='fk_repositories_tags_repo_id'),
+            primary_key=True
+        ),
+    )
+    # covering index of the tags per repository, also backing the repo_id foreign key.
+    op.create_index('ix_repositories_tags_repo_id_tag_id', 'repositories_tags_new', ['repo_id', 'tag_id'])
+    op.execute(
+        'INSERT INTO repositories_tags_new (tag_id, repo_id) '
+        'SELECT DISTINCT tag_id, repo_id FROM repositories_tags '
+        'WHERE tag_id IS NOT NULL AND repo_id IS NOT NULL'
+    )
+    op.drop_table('repositories_tags')
+    op.rename_table('repositories_tags_new', 'repositories_tags')
+
+
+def downgrade():
+    op.drop_index('ix_repositories_tags_repo_id_tag_id', 'repositories_tags')
+    op.rename_table('repositories_tags', 'repositories_tags_new')
+    op.create_table(
+        'repositories_tags',
+        sqlalchemy.Column('tag_id', sqlalchemy.Integer, sqlalchemy.ForeignKey('tags.id_'), index=True),
+        sqlalchemy.Column('repo_id', sqlalchemy.Integer, sqlalchemy.ForeignKey('repositories.id_'), index=True),
+    )
+    op.execute(
+        'INSERT INTO repositories_tags (tag_id, repo_id) '
+        'SELECT tag_id, repo_id FROM repositories_tags_new'
+    )
+    op.drop_table('repositories_tags_new')
+
+    op.drop_index('ix_tags_popularity', 'tags')
+    op.drop_index('ix_repositories_downloads_name', 'repositories')
+
+    for table, column in [('tags', 'popularity'), ('repositories', 'downloads')]:
+        with _batch_alter_table(table) as batch:
+            batch.alter_column(column, existing_type=sqlalchemy.Integer, nullable=True, server_default=None)
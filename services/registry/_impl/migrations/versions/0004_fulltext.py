@@ -0,0 +1,25 @@
+""" Full text index of the repositories names and descriptions (mysql only).
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+# other dbs are searched with LIKE, see RegistryDatabaseSessionWrapper.search_repos.
+def upgrade():
+    if op.get_bind().dialect.name == 'mysql':
+        op.create_index('ix_repositories_fulltext', 'repositories', ['name', 'description'], mysql_prefix='FULLTEXT')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'mysql':
+        op.drop_index('ix_repositories_fulltext', 'repositories')
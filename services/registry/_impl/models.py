@@ -1,6 +1,7 @@
 """ Database models for the service.
 """
 
+import datetime
 import sqlalchemy
 from sqlalchemy.ext import declarative
 
@@ -18,13 +19,17 @@ repositories_tags = sqlalchemy.Table(
     sqlalchemy.Column(
         'tag_id',
         sqlalchemy.Integer,
-        sqlalchemy.ForeignKey('tags.id_')
+        sqlalchemy.ForeignKey('tags.id_'),
+        primary_key=True
     ),
     sqlalchemy.Column(
         'repo_id',
         sqlalchemy.Integer,
-        sqlalchemy.ForeignKey('repositories.id_')
+        sqlalchemy.ForeignKey('repositories.id_'),
+        primary_key=True
     ),
+    # tags of the repositories, read from the index only.
+    sqlalchemy.Index('ix_repositories_tags_repo_id_tag_id', 'repo_id', 'tag_id'),
 )
 
 
@@ -35,7 +40,7 @@ class Tag(DeclarativeBase):
 
     id_ = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
     name = sqlalchemy.Column(sqlalchemy.String(30), unique=True)
-    popularity = sqlalchemy.Column(sqlalchemy.Integer, default=lambda: 0)
+    popularity = sqlalchemy.Column(sqlalchemy.Integer, default=lambda: 0, server_default='0', nullable=False)
     association = sqlalchemy.orm.relationship(
         'Repository',
         secondary=repositories_tags,
@@ -51,5 +56,20 @@ class Repository(DeclarativeBase):
     id_ = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
     name = sqlalchemy.Column(sqlalchemy.String(100), unique=True)
     description = sqlalchemy.Column(sqlalchemy.String(500))
-    downloads = sqlalchemy.Column(sqlalchemy.Integer, default=lambda: 0)
+    downloads = sqlalchemy.Column(sqlalchemy.Integer, default=lambda: 0, server_default='0', nullable=False)
     uri = sqlalchemy.Column(sqlalchemy.String(500), unique=True)
+
+
+# listings are ranked by popularity and by (downloads, name).
+sqlalchemy.Index('ix_tags_popularity', Tag.popularity.desc())
+sqlalchemy.Index('ix_repositories_downloads_name', Repository.downloads.desc(), Repository.name.desc())
+
+
+class Flush(DeclarativeBase):
+    """ Class for flush table, log of the buffered batches applied to the db.
+    """
+    __tablename__ = 'flushes'
+
+    batch_id = sqlalchemy.Column(sqlalchemy.String(32), primary_key=True)
+    kind = sqlalchemy.Column(sqlalchemy.String(30))
+    created = sqlalchemy.Column(sqlalchemy.DateTime, default=datetime.datetime.utcnow)
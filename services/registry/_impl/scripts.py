@@ -0,0 +1,446 @@
+""" Lua scripts executed server side by the registry cache.
+
+Scripts working on item keys (labels, repos) build them from the prefixes
+passed in ARGV, so they assume a single redis instance (no cluster key slots).
+"""
+
+
+# Keyset paging over sorted sets ranked by (downloads, name) descending,
+# the order of ZREVRANGEBYSCORE. Defines the stream of a label key, returning
+# its entries after the cursor page by page.
+# Expects cursor_downloads, cursor_name and limit (0 means no limit) locals.
+PAGING = """
+local function after_cursor(name, downloads)
+    return cursor_downloads == nil or downloads < cursor_downloads
+        or (downloads == cursor_downloads and name < cursor_name)
+end
+
+local function fetch(stream)
+    local args = {'ZREVRANGEBYSCORE', stream.key, cursor_downloads or '+inf', '-inf', 'WITHSCORES'}
+    if limit > 0 then
+        table.insert(args, 'LIMIT')
+        table.insert(args, stream.offset)
+        table.insert(args, limit)
+    end
+
+    local members = redis.call(unpack(args))
+    stream.offset = stream.offset + #members / 2
+    stream.ended = limit == 0 or #members / 2 < limit
+    stream.items, stream.index = {}, 1
+
+    for i = 1, #members, 2 do
+        local downloads = tonumber(members[i + 1])
+        if after_cursor(members[i], downloads) then
+            table.insert(stream.items, {members[i], downloads})
+        end
+    end
+end
+
+local function stream(key, tag)
+    return {key = key, tag = tag, offset = 0, items = {}, index = 1, ended = false}
+end
+
+-- next entry of the stream, nil once exhausted
+local function head(s)
+    while s.index > #s.items do
+        if s.ended then
+            return nil
+        end
+        fetch(s)
+    end
+    return s.items[s.index]
+end
+
+local function exhausted(s)
+    return s.ended and s.index > #s.items
+end
+"""
+
+
+# ARGV: tags key, labels prefix, repos prefix, labels ttl, repos ttl, max label size,
+#       limit, cursor downloads, cursor name, tag names...
+# Returns: {non cached tags, {{repo name, downloads, repo hash}, ...}, capped tags}
+#          capped tags are the ones whose label was read to its cap, the rest of them is in db only.
+GET_REPOS_FROM_TAGS = """
+local tags_key, labels_prefix, repos_prefix = ARGV[1], ARGV[2], ARGV[3]
+local labels_ttl, repos_ttl = tonumber(ARGV[4]), tonumber(ARGV[5])
+local max_label_size, limit = tonumber(ARGV[6]), tonumber(ARGV[7])
+local cursor_downloads, cursor_name = tonumber(ARGV[8]), ARGV[9]
+""" + PAGING + """
+local tags = {}
+for i = 10, #ARGV do
+    table.insert(tags, ARGV[i])
+end
+
+-- no tags means every cached tag
+if #tags == 0 then
+    tags = redis.call('ZREVRANGEBYSCORE', tags_key, '+inf', 0)
+end
+
+local non_cached_tags = {}
+local streams = {}
+
+for _, tag in ipairs(tags) do
+    local label_key = labels_prefix .. tag
+    local size = redis.call('ZCARD', label_key)
+    if size == 0 then
+        table.insert(non_cached_tags, tag)
+    else
+        if labels_ttl > 0 then
+            redis.call('EXPIRE', label_key, labels_ttl)
+        end
+        local s = stream(label_key, tag)
+        s.capped = max_label_size > 0 and size >= max_label_size
+        table.insert(streams, s)
+    end
+end
+
+-- k-way merge of the labels, stops after limit repositories
+local names, downloads, labels = {}, {}, {}
+while limit == 0 or #names < limit do
+    local best, best_item = nil, nil
+    for _, s in ipairs(streams) do
+        local item = head(s)
+        if item and (best == nil or item[2] > best_item[2]
+                or (item[2] == best_item[2] and item[1] > best_item[1])) then
+            best, best_item = s, item
+        end
+    end
+    if best == nil then
+        break
+    end
+    best.index = best.index + 1
+
+    local name = best_item[1]
+    if downloads[name] == nil then
+        downloads[name] = best_item[2]
+        labels[name] = {}
+        table.insert(names, name)
+    end
+    table.insert(labels[name], best.tag)
+end
+
+local incomplete = {}
+local function set_incomplete(tag)
+    if not incomplete[tag] then
+        incomplete[tag] = true
+        table.insert(non_cached_tags, tag)
+    end
+end
+
+local repos = {}
+for _, name in ipairs(names) do
+    local repo_key = repos_prefix .. name
+    local details = redis.call('HGETALL', repo_key)
+    if #details > 0 then
+        if repos_ttl > 0 then
+            redis.call('EXPIRE', repo_key, repos_ttl)
+        end
+        table.insert(repos, {name, tostring(downloads[name]), details})
+    else
+        -- expired or evicted repository, its labels have to be filled again
+        for _, tag in ipairs(labels[name]) do
+            set_incomplete(tag)
+        end
+    end
+end
+
+-- a capped label read to its end may miss repositories beyond its cap
+local capped_tags = {}
+for _, s in ipairs(streams) do
+    if s.capped and exhausted(s) and not incomplete[s.tag] then
+        table.insert(capped_tags, s.tag)
+    end
+end
+
+return {non_cached_tags, repos, capped_tags}
+"""
+
+
+# ARGV: labels prefix, repos prefix, labels ttl, repos ttl, max label size, temporary key,
+#       limit, cursor downloads, cursor name, tag names...
+# Returns: {non cached tags, {{repo name, downloads, repo hash}, ...}}
+GET_REPOS_WITH_ALL_TAGS = """
+local labels_prefix, repos_prefix = ARGV[1], ARGV[2]
+local labels_ttl, repos_ttl = tonumber(ARGV[3]), tonumber(ARGV[4])
+local max_label_size, intersection = tonumber(ARGV[5]), ARGV[6]
+local limit = tonumber(ARGV[7])
+local cursor_downloads, cursor_name = tonumber(ARGV[8]), ARGV[9]
+""" + PAGING + """
+local tags = {}
+local label_keys = {}
+local non_cached_tags = {}
+for i = 10, #ARGV do
+    local label_key = labels_prefix .. ARGV[i]
+    local size = redis.call('ZCARD', label_key)
+    -- a capped label may miss repositories of the intersection
+    if size == 0 or (max_label_size > 0 and size >= max_label_size) then
+        table.insert(non_cached_tags, ARGV[i])
+    end
+    table.insert(tags, ARGV[i])
+    table.insert(label_keys, label_key)
+end
+
+if #non_cached_tags > 0 then
+    return {non_cached_tags, {}}
+end
+
+-- downloads are the same in every label, MAX keeps them as is
+local args = {intersection, #label_keys}
+for _, label_key in ipairs(label_keys) do
+    table.insert(args, label_key)
+end
+table.insert(args, 'AGGREGATE')
+table.insert(args, 'MAX')
+redis.call('ZINTERSTORE', unpack(args))
+
+local members = {}
+local s = stream(intersection)
+while limit == 0 or #members < limit do
+    local item = head(s)
+    if item == nil then
+        break
+    end
+    s.index = s.index + 1
+    table.insert(members, item)
+end
+redis.call('DEL', intersection)
+
+if labels_ttl > 0 then
+    for _, label_key in ipairs(label_keys) do
+        redis.call('EXPIRE', label_key, labels_ttl)
+    end
+end
+
+local repos = {}
+for _, item in ipairs(members) do
+    local repo_key = repos_prefix .. item[1]
+    local details = redis.call('HGETALL', repo_key)
+    if #details == 0 then
+        -- expired or evicted repository, labels have to be filled again
+        return {tags, {}}
+    end
+    if repos_ttl > 0 then
+        redis.call('EXPIRE', repo_key, repos_ttl)
+    end
+    table.insert(repos, {item[1], tostring(item[2]), details})
+end
+
+return {non_cached_tags, repos}
+"""
+
+
+# KEYS: pending hash, batch hash, batch id, pending count
+# ARGV: new batch id
+# Returns: {batch id, batch hash} or {} when nothing is pending.
+POP_BATCH = """
+local pending, batch, batch_id, count = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+
+-- an unacknowledged batch is handed out again until it is acknowledged
+if redis.call('EXISTS', batch) == 0 then
+    if redis.call('EXISTS', pending) == 0 then
+        return {}
+    end
+    redis.call('RENAME', pending, batch)
+    redis.call('SET', batch_id, ARGV[1])
+    redis.call('DEL', count)
+end
+
+return {redis.call('GET', batch_id), redis.call('HGETALL', batch)}
+"""
+
+
+# KEYS: batch hash, batch id
+# ARGV: batch id
+# Returns: 1 if the batch is acknowledged.
+ACK_BATCH = """
+if redis.call('GET', KEYS[2]) == ARGV[1] then
+    redis.call('DEL', KEYS[1], KEYS[2])
+    return 1
+end
+return 0
+"""
+
+
+# KEYS: totals hash, pending hash
+# ARGV: repo name, repos prefix, labels prefix, invalidation channel, invalidation, seed (optional)
+# Returns: new downloads of the repository or nil if its total is unknown (no seed).
+COUNT_DOWNLOAD = """
+local totals, pending = KEYS[1], KEYS[2]
+local name, repos_prefix, labels_prefix = ARGV[1], ARGV[2], ARGV[3]
+
+if redis.call('HEXISTS', totals, name) == 0 then
+    if ARGV[6] == nil then
+        return false
+    end
+    redis.call('HSETNX', totals, name, ARGV[6])
+end
+
+redis.call('HINCRBY', pending, name, 1)
+local downloads = redis.call('HINCRBY', totals, name, 1)
+
+-- keep the cached repository and its labels in sync
+local repo_key = repos_prefix .. name
+local fields = redis.call('HMGET', repo_key, 'v', 't')
+if fields[1] then
+    redis.call('HINCRBY', repo_key, 'n', 1)
+    for _, label in ipairs(cjson.decode(fields[2])) do
+        if redis.call('ZSCORE', labels_prefix .. label, name) then
+            redis.call('ZINCRBY', labels_prefix .. label, 1, name)
+        end
+    end
+elseif redis.call('EXISTS', repo_key) == 1 then
+    redis.call('HINCRBY', repo_key, 'downloads', 1)
+end
+
+redis.call('PUBLISH', ARGV[4], ARGV[5])
+
+return downloads
+"""
+
+
+# ARGV: repos prefix, labels prefix, invalidation channel, invalidation,
+#       then pairs of repo name and downloads
+# Returns: number of cached repositories updated.
+# Downloads only grow, so the greatest one wins whatever order the updates are applied in.
+SET_DOWNLOADS = """
+local repos_prefix, labels_prefix = ARGV[1], ARGV[2]
+local updated = 0
+
+for i = 5, #ARGV, 2 do
+    local name, downloads = ARGV[i], tonumber(ARGV[i + 1])
+    local repo_key = repos_prefix .. name
+    local fields = redis.call('HMGET', repo_key, 'v', 't', 'n', 'downloads')
+
+    if fields[1] then
+        if tonumber(fields[3] or 0) < downloads then
+            redis.call('HSET', repo_key, 'n', downloads)
+        end
+        for _, label in ipairs(cjson.decode(fields[2])) do
+            local score = redis.call('ZSCORE', labels_prefix .. label, name)
+            if score and tonumber(score) < downloads then
+                redis.call('ZADD', labels_prefix .. label, downloads, name)
+            end
+        end
+        updated = updated + 1
+    elseif fields[4] then
+        if tonumber(fields[4]) < downloads then
+            redis.call('HSET', repo_key, 'downloads', downloads)
+        end
+        updated = updated + 1
+    end
+end
+
+redis.call('PUBLISH', ARGV[3], ARGV[4])
+
+return updated
+"""
+
+
+# KEYS: totals hash
+# ARGV: repos prefix, labels prefix, labels ttl, repos ttl, max label size, cached labels only (0 or 1),
+#       then triples of repo name, repo hash (json) and labels (json array)
+# Returns: number of distinct keys written.
+# Fills never lower the downloads: downloads counted in the totals and not flushed to db yet,
+# or greater cached ones, win over the db ones. Repository and labels are given the same downloads.
+FILL_REPOS = """
+local totals, repos_prefix, labels_prefix = KEYS[1], ARGV[1], ARGV[2]
+local labels_ttl, repos_ttl = tonumber(ARGV[3]), tonumber(ARGV[4])
+local max_label_size, cached_only = tonumber(ARGV[5]), ARGV[6] == '1'
+local written, keys = {}, 0
+
+local function write(key)
+    if not written[key] then
+        written[key] = true
+        keys = keys + 1
+    end
+end
+
+local function greatest(downloads, value)
+    if value then
+        return math.max(downloads, tonumber(value))
+    end
+    return downloads
+end
+
+for i = 7, #ARGV, 3 do
+    local name, fields, labels = ARGV[i], cjson.decode(ARGV[i + 1]), cjson.decode(ARGV[i + 2])
+    local repo_key = repos_prefix .. name
+
+    local label_keys = {}
+    for _, label in ipairs(labels) do
+        local label_key = labels_prefix .. label
+        if not cached_only or redis.call('EXISTS', label_key) == 1 then
+            table.insert(label_keys, label_key)
+        end
+    end
+
+    -- repositories without cached labels are left out
+    if #label_keys > 0 or not cached_only then
+        local cached = redis.call('HMGET', repo_key, 'v', 'n', 'downloads')
+        local downloads = tonumber(fields['n']) or 0
+        downloads = greatest(downloads, redis.call('HGET', totals, name))
+        downloads = greatest(downloads, cached[2])
+        downloads = greatest(downloads, cached[3])
+
+        -- legacy entries are rewritten in the current encoding
+        if not cached[1] then
+            redis.call('DEL', repo_key)
+        end
+
+        local args = {'HMSET', repo_key}
+        fields['n'] = downloads
+        for field, value in pairs(fields) do
+            table.insert(args, field)
+            table.insert(args, value)
+        end
+        redis.call(unpack(args))
+        if repos_ttl > 0 then
+            redis.call('EXPIRE', repo_key, repos_ttl)
+        end
+        write(repo_key)
+
+        for _, label_key in ipairs(label_keys) do
+            redis.call('ZADD', label_key, 'GT', downloads, name)
+            if max_label_size > 0 then
+                redis.call('ZREMRANGEBYRANK', label_key, 0, -(max_label_size + 1))
+            end
+            if labels_ttl > 0 then
+                redis.call('EXPIRE', label_key, labels_ttl)
+            end
+            write(label_key)
+        end
+    end
+end
+
+return keys
+"""
+
+
+# KEYS: lock keys
+# ARGV: lock token
+# Returns: number of released locks.
+RELEASE_LOCKS = """
+local released = 0
+for _, key in ipairs(KEYS) do
+    if redis.call('GET', key) == ARGV[1] then
+        released = released + redis.call('DEL', key)
+    end
+end
+return released
+"""
+
+
+class Scripts(object):
+    """ Scripts registered against a redis client,
+        each one is called with EVALSHA (falls back to EVAL once per script).
+    """
+    def __init__(self, client):
+        self.get_repos_from_tags = client.register_script(GET_REPOS_FROM_TAGS)
+        self.get_repos_with_all_tags = client.register_script(GET_REPOS_WITH_ALL_TAGS)
+        self.pop_batch = client.register_script(POP_BATCH)
+        self.ack_batch = client.register_script(ACK_BATCH)
+        self.count_download = client.register_script(COUNT_DOWNLOAD)
+        self.release_locks = client.register_script(RELEASE_LOCKS)
+        self.set_downloads = client.register_script(SET_DOWNLOADS)
+        self.fill_repos = client.register_script(FILL_REPOS)
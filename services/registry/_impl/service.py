@@ -5,42 +5,90 @@
 import eventlet
 eventlet.monkey_patch()
 
+import functools
+import heapq
 import operator
-from nameko import containers, rpc
+import time
+import uuid
+from nameko import containers, events, rpc, timer
 
 import base
 import registry
 
 from . import (
     cache as _cache,
+    entrypoints,
     models,
     db as _db
 )
 
 
-def _repo_info(repo):
-    return {
-        'name': repo.name,
-        'description': repo.description,
-        'downloads': repo.downloads,
-        'uri': repo.uri,
-        'tags': [tag.name for tag in repo.labels]
-    }
+def _merge_pages(pages, limit=None):
+    """ Merge pages of repositories ranked by (downloads, name), dropping duplicates.
+
+        Args:
+            pages (list): lists of repositories, each one already ranked.
+
+        Kwargs:
+            limit (int): maximum number of repositories kept, None means all of them.
+
+        Returns:
+            list: of the merged repositories.
+    """
+    ranked = heapq.merge(
+        *pages,
+        key=lambda repo: (repo['downloads'] or 0, repo['name']),
+        reverse=True
+    )
+
+    repos, names = [], set()
+    for repo in ranked:
+        if limit and len(repos) == limit:
+            break
+        if repo['name'] not in names:
+            names.add(repo['name'])
+            repos.append(repo)
+
+    return repos
 
 
 class RegistryService(base.BaseService):
     name = registry.service_name
     db = _db.RegistryDatabaseSession(models.DeclarativeBase)
     cache = _cache.RegistryCache()
+    dispatch = events.EventDispatcher()
+
+    def _update_cache(self, event_type, payload, update):
+        """ Update the cache after a write, either through an event handled
+            by the cache updater service or right away.
+
+            Args:
+                event_type (str): type of the event dispatched.
+                payload (dict): event payload, holding absolute values so that updates can be replayed.
+                update (callable): updates the cache inline.
+        """
+        if registry.config['CACHE_UPDATES']['MODE'] == 'events':
+            # id counts the deliveries of the event, across requeues.
+            self.dispatch(event_type, dict(payload, id=uuid.uuid4().hex))
+            registry.logger.info('Event({}) dispatched for cache updates.'.format(event_type))
+            return
+
+        try:
+            update()
+        except Exception:
+            registry.logger.error(
+                'Exception occurred while updating cache for Event({}).'.format(event_type),
+                exc_info=True
+            )
 
     @rpc.rpc
-    def get_tags(self, tags=None):
+    def get_tags(self, tags=None, limit=None):
         tags = tags or []
         registry.logger.debug('Tags supplied are : {}'.format(tags))
         cached_tags, non_cached_tags = [], []
 
         try:
-            cached_tags, non_cached_tags = self.cache.get_tags(tags)
+            cached_tags, non_cached_tags = self.cache.get_tags(tags, limit)
         except Exception as e:
             registry.logger.error(
                 'Exception occurred while fetching cache.',
@@ -53,9 +101,12 @@ class RegistryService(base.BaseService):
             )
             return cached_tags + non_cached_tags
 
+        if not tags:
+            return self._load_tags(limit)
+
         non_cached_tags = [
             (tag.name, tag.popularity)
-            for tag in self.db.get_tags(non_cached_tags)
+            for tag in self.db.get_tags(non_cached_tags, limit)
         ]
 
         registry.logger.info(
@@ -75,21 +126,73 @@ class RegistryService(base.BaseService):
 
         return cached_tags + non_cached_tags
 
+    def _load_tags(self, limit=None):
+        # cache is trusted for all the tags only once it holds all of them.
+        tags = [(tag.name, tag.popularity) for tag in self.db.get_tags()]
+
+        try:
+            self.cache.load_tags(tags)
+            registry.logger.info('Tags({}) loaded in cache.'.format(len(tags)))
+        except Exception:
+            registry.logger.error(
+                'Exception occurred while loading Tags() in cache.',
+                exc_info=True
+            )
+
+        return tags[:limit] if limit else tags
+
     @rpc.rpc
     def add_tags(self, tags):
-        tags_in_db = self.get_tags(tags)
+        # existing tags are skipped by the db, concurrent adds don't collide.
+        self.db.add_tags(tags)
+
+        registry.logger.info('Tags({}) added to db.'.format(tags))
+
+        # cached popularity of existing tags is kept.
+        tag_objs = [(tag, 1) for tag in tags]
+        self._update_cache(
+            'tags_added',
+            {'tags': tags},
+            functools.partial(self.cache.add_tags, tag_objs, nx=True)
+        )
+
+    @rpc.rpc
+    def complete_tags(self, prefix, limit=10):
+        tags = None
+
+        try:
+            tags = self.cache.complete_tags(prefix, limit)
+        except Exception:
+            registry.logger.error(
+                'Exception occurred while completing Prefix({}) from cache.'.format(prefix),
+                exc_info=True
+            )
+
+        if tags is not None:
+            registry.logger.info(
+                'Result: Tags({}) completed from cache for Prefix({}).'.format(tags, prefix)
+            )
+            return tags
+
+        tags = [(tag.name, tag.popularity) for tag in self.db.complete_tags(prefix, limit)]
 
-        tags_to_add = list(
-            set(tags).difference([tag[0] for tag in tags_in_db])
+        registry.logger.info(
+            'Result: Tags({}) completed from db for Prefix({}).'.format(tags, prefix)
         )
-        self.db.add_tags(tags_to_add)
 
-        registry.logger.info('Tags({}) added to db.'.format(tags_to_add))
+        # index is not built (e.g. redis was flushed), build it for the next completions.
+        self._index_tags()
 
-        tag_objs = [(tag, 1) for tag in tags]
-        self.cache.add_tags(tag_objs)
+        return tags
 
-        registry.logger.info('Tags({}) added to cache.'.format(tags))
+    def _index_tags(self):
+        try:
+            self.cache.build_tags_index(self.db.get_tag_names)
+        except Exception:
+            registry.logger.error(
+                'Exception occurred while indexing tags for completion.',
+                exc_info=True
+            )
 
     @rpc.rpc
     def add_repos(self, repos):
@@ -105,46 +208,117 @@ class RegistryService(base.BaseService):
 
         added_repos = self.db.add_repos(repos)
 
-        repo_names = [repo.name for repo in added_repos]
+        repo_names = [repo['name'] for repo in added_repos]
         registry.logger.info('Repos({}) added to db.'.format(repo_names))
 
         if added_repos:
-            try:
-                self.cache.update_repos(added_repos)
+            self._update_cache(
+                'repos_added',
+                {'repos': added_repos},
+                functools.partial(self.cache.update_repos, added_repos)
+            )
 
-                repo_names = [repo.name for repo in added_repos]
-                registry.logger.info(
-                    'Repos({}) added to cache.'.format(repo_names),
+    @rpc.rpc
+    def get_repos(self, tags=None, match='any', limit=None, cursor=None):
+        tags = tags or []
+
+        if tags:
+            self._buffer_popularity(tags)
+
+        if match == 'all' and tags:
+            return self._get_repos_with_all_tags(tags, limit, cursor)
+
+        # unfiltered listing spans the whole catalog, it is paged by db on its index.
+        if not tags:
+            repos = list(self.db.iter_repos_from_tags(limit=limit, cursor=cursor))
+
+            registry.logger.info(
+                'Result: Repos({}).'.format([repo['name'] for repo in repos])
+            )
+
+            return repos
+
+        # fetch the page from cache
+        cached_repos, non_cached_tags, capped_tags = self.cache.get_repos_from_tags(tags, limit, cursor)
+
+        registry.logger.info(
+            'Repos({}) fetched from cache.\n Tags({}) are not in cache'.format(cached_repos, non_cached_tags)
+        )
+
+        # fill only non cached tags from db, once per tag across the instances.
+        # db page is streamed into the merge.
+        db_repos = []
+        if non_cached_tags:
+            try:
+                loaded_repos, filled_tags, missing_tags = self.cache.coalesce(
+                    non_cached_tags,
+                    functools.partial(self._load_repos, tags)
                 )
             except Exception:
                 registry.logger.error(
-                    'Exception occurred while updating Repos() to cache.'.format(repo_names),
+                    'Exception occurred while coalescing Tags({}).'.format(non_cached_tags),
                     exc_info=True
                 )
+                loaded_repos, filled_tags = [], []
 
-    @rpc.rpc
-    def get_repos(self, tags=None):
-        tags = tags or []
+            # the page is merged again from the filled labels.
+            if loaded_repos or filled_tags:
+                cached_repos, non_cached_tags, capped_tags = self.cache.get_repos_from_tags(tags, limit, cursor)
 
-        if tags:
-            self.db.update_popularity(tags)
+        # labels hold the most downloaded repositories only, deeper pages of
+        # capped tags are read from db without filling them again.
+        if non_cached_tags or capped_tags:
+            db_repos = self.db.iter_repos_from_tags(non_cached_tags + capped_tags, limit=limit, cursor=cursor)
+
+        repos = _merge_pages([cached_repos, db_repos], limit)
+        repo_names = [repo['name'] for repo in repos]
+
+        registry.logger.info(
+            'Result: Repos({}).'.format(repo_names)
+        )
+
+        return repos
 
-        # fetch from cache
-        cached_repos, non_cached_tags = self.cache.get_repos_from_tags(tags)
+    def _get_repos_with_all_tags(self, tags, limit=None, cursor=None):
+        cached_repos, non_cached_tags = [], tags
 
-        for c_repo in cached_repos:
-            c_repo['tags'] = eval(c_repo['tags'])
+        try:
+            cached_repos, non_cached_tags = self.cache.get_repos_with_all_tags(tags, limit, cursor)
+        except Exception:
+            registry.logger.error(
+                'Exception occurred while fetching cache.',
+                exc_info=True
+            )
+
+        if not non_cached_tags:
+            registry.logger.info(
+                'Result: Repos({}) with all Tags({}) fetched from cache.'.format(
+                    [repo['name'] for repo in cached_repos], tags
+                )
+            )
+            return cached_repos
+
+        # intersection is done by db, labels are filled by the any tag queries.
+        db_repos = self.db.get_repos_from_tags(tags, match='all', limit=limit, cursor=cursor)
 
         registry.logger.info(
-            'Repos({}) fetched from cache.\n Tags({}) are not in cache'.format(cached_repos, non_cached_tags)
+            'Result: Repos({}) with all Tags({}) fetched from db.'.format(
+                [repo['name'] for repo in db_repos], tags
+            )
         )
 
-        # fetch only non cached tags from db
-        db_repos = []
-        if not cached_repos or non_cached_tags:
-            db_repos = self.db.get_repos_from_tags(non_cached_tags)
+        return db_repos
+
+    def _load_repos(self, tags, non_cached_tags):
+        # a label keeps MAX_LABEL_SIZE repositories, more would never be read from cache.
+        label_size = registry.config['CACHE']['MAX_LABEL_SIZE'] or None
+        db_repos = {}
+        for tag in non_cached_tags:
+            for repo in self.db.get_repos_from_tags([tag], limit=label_size):
+                db_repos[repo['name']] = repo
+        db_repos = list(db_repos.values())
 
-        db_repo_names = [repo.name for repo in db_repos]
+        db_repo_names = [repo['name'] for repo in db_repos]
         registry.logger.info(
             'Repos({}) fetched from db.'.format(db_repo_names)
         )
@@ -164,22 +338,44 @@ class RegistryService(base.BaseService):
                     exc_info=True
                 )
 
-        db_repos = [
-            _repo_info(repo)
-            for repo in db_repos
-        ]
+        return db_repos
 
-        #  get unique repos for final result
-        repos = cached_repos + db_repos
-        repos = list({repo['name']: repo for repo in repos}.values())
-        repo_names = [repo['name'] for repo in repos]
+    def _buffer_popularity(self, tags):
+        try:
+            pending = self.cache.buffer_popularity(tags)
+        except Exception:
+            registry.logger.error(
+                'Exception occurred while buffering popularity for Tags({}).'.format(tags),
+                exc_info=True
+            )
+            self.db.update_popularity(tags)
+            return
+
+        registry.logger.debug('{} popularity increments pending.'.format(pending))
+
+    @timer.timer(interval=registry.config['POPULARITY']['FLUSH_INTERVAL'])
+    def flush_popularity(self):
+        self._flush('popularity', self.db.apply_popularity)
+
+    @timer.timer(interval=registry.config['POPULARITY']['CHECK_INTERVAL'])
+    def check_popularity(self):
+        # pending increments past the bound are flushed before the interval ends,
+        # by the timer rather than by the reads buffering them.
+        if self.cache.pending_count('popularity') >= registry.config['POPULARITY']['MAX_PENDING']:
+            self.flush_popularity()
+
+    def _flush(self, kind, apply):
+        batch_id, counts = self.cache.pop_batch(kind)
+        if not batch_id:
+            return
+
+        apply(batch_id, counts)
+        self.cache.ack_batch(kind, batch_id)
 
         registry.logger.info(
-            'Result: Repos({}).'.format(repo_names)
+            'Batch({}) of {} increments({}) flushed to db.'.format(batch_id, kind, counts)
         )
 
-        return repos
-
     @rpc.rpc
     def get_repo(self, repo):
         result = {}
@@ -194,7 +390,6 @@ class RegistryService(base.BaseService):
 
         if result:
             registry.logger.info('Repo({}) details fetched from cache.'.format(repo))
-            result['tags'] = eval(result['tags'])
             return result
 
         repo_details = self.db.get_repo_details(repo)
@@ -205,21 +400,145 @@ class RegistryService(base.BaseService):
         self.cache.update_repos([repo_details])
         registry.logger.info('Repo({}) added to cache.'.format(repo))
 
-        # TODO: there are other places where same dict of repo details are getting used.
-        # should be a skeleton dict and reference it here to fill the values.
-        return _repo_info(repo_details)
+        return repo_details
 
     @rpc.rpc
-    def update_downloads(self, repo):
+    def get_repos_by_name(self, repos):
+        found = {}
+
         try:
-            self.cache.update_downloads([repo])
-        except Exception as e:
+            found = self.cache.get_repos_details(repos)
+        except Exception:
             registry.logger.error(
-                'Exception occurred while updating downloads for Repo({}).'.format(repo),
+                'Exception occurred while fetching cache.',
                 exc_info=True
             )
+
+        non_cached_repos = [repo for repo in set(repos) if repo not in found]
+        if non_cached_repos:
+            db_repos = self.db.get_repos_by_name(non_cached_repos)
+
+            registry.logger.info(
+                'Repos({}) fetched from db.'.format([repo['name'] for repo in db_repos])
+            )
+
+            if db_repos:
+                try:
+                    self.cache.update_repos(db_repos)
+                except Exception:
+                    registry.logger.error(
+                        'Exception occurred while updating Repos({}) to cache.'.format(non_cached_repos),
+                        exc_info=True
+                    )
+
+            found.update((repo['name'], repo) for repo in db_repos)
+
+        # caller's order is kept.
+        result = {
+            'repos': [found[repo] for repo in repos if repo in found],
+            'not_found': [repo for repo in repos if repo not in found],
+        }
+
+        registry.logger.info(
+            'Result: Repos({}). Not found Repos({}).'.format(
+                [repo['name'] for repo in result['repos']], result['not_found']
+            )
+        )
+
+        return result
+
+    @rpc.rpc
+    def search_repos(self, query, limit=20):
+        repos = self.db.search_repos(query, limit)
+
+        registry.logger.info(
+            'Result: Repos({}) for Query({}).'.format([repo['name'] for repo in repos], query)
+        )
+
+        return repos
+
+    @rpc.rpc
+    def update_downloads(self, repo):
+        if registry.config['DOWNLOADS']['MODE'] == 'buffered':
+            try:
+                return self._count_download(repo)
+            except Exception:
+                registry.logger.error(
+                    'Exception occurred while counting download for Repo({}).'.format(repo),
+                    exc_info=True
+                )
+
         self.db.update_downloads([repo])
 
+        repo_details = self.db.get_repo_details(repo)
+        if not repo_details:
+            return None
+
+        # new total rather than an increment, updates may be applied more than once.
+        self._update_cache(
+            'downloads_updated',
+            {'downloads': {repo: repo_details['downloads']}},
+            functools.partial(self.cache.set_downloads, {repo: repo_details['downloads']})
+        )
+
+        return repo_details['downloads']
+
+    def _count_download(self, repo):
+        downloads = self.cache.count_download(repo)
+        if downloads is not None:
+            return downloads
+
+        # running total is not known yet, seed it from db.
+        repo_details = self.db.get_repo_details(repo)
+        if not repo_details:
+            return None
+
+        return self.cache.count_download(repo, repo_details['downloads'] or 0)
+
+    @timer.timer(interval=registry.config['DOWNLOADS']['FLUSH_INTERVAL'])
+    def flush_downloads(self):
+        self._flush('downloads', self.db.apply_downloads)
+
+    @entrypoints.once
+    def warm_up_cache(self):
+        budget = registry.config['WARM_UP']
+        start = time.time()
+
+        self._index_tags()
+
+        tags = [(tag.name, tag.popularity) for tag in self.db.get_tags(limit=budget['TAGS'])]
+        if tags:
+            self.cache.add_tags(tags)
+
+        warmed_tags, keys = 0, 1 if tags else 0
+        for name, _ in tags:
+            if time.time() - start > budget['TIME_LIMIT']:
+                break
+
+            repos = self.db.get_repos_from_tags([name], limit=registry.config['CACHE']['MAX_LABEL_SIZE'] or None)
+            keys += self.cache.warm_up([name], repos)
+            warmed_tags += 1
+
+        duration = time.time() - start
+        registry.logger.info(
+            'Cache warmed up for Tags({}/{}) with {} keys in {:.3f}s.'.format(
+                warmed_tags, len(tags), keys, duration
+            ),
+            extra={
+                'warm_up_tags': warmed_tags,
+                'warm_up_keys': keys,
+                'warm_up_duration': duration,
+            }
+        )
+
+    @rpc.rpc
+    def get_cache_stats(self):
+        return {'local': self.cache.local_stats()}
+
+    @rpc.rpc
+    def get_cache_report(self, samples=100):
+        return self.cache.keyspace_report(samples=samples)
+
 
 def create_container():
     return containers.ServiceContainer(RegistryService, config=registry.config)
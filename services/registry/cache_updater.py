@@ -0,0 +1,9 @@
+""" Cache updater entrypoint for docker compose which also act as a bootstrap for service.
+"""
+from ._impl import cache_updater
+
+
+if __name__ == '__main__':
+    container = cache_updater.create_container()
+    container.start()
+    container.wait()
@@ -0,0 +1,114 @@
+""" Fixtures of the services tests, run from the services directory:
+    pip install -r tests/requirements.txt
+    python -m pytest tests
+"""
+
+import collections
+import logging
+import os
+import sys
+import types
+
+import fakeredis
+import pytest
+import sqlalchemy
+import yaml
+from redis.commands import core
+from sqlalchemy import orm
+
+
+SERVICES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, SERVICES_DIR)
+
+
+def _parse(*parts):
+    with open(os.path.join(SERVICES_DIR, *parts), 'r') as file_h:
+        return yaml.safe_load(file_h)
+
+
+def _get_config(service_name):
+    # same overrides as _utils.config.get_config.
+    config = _parse('config.yml')
+    for category, details in _parse(service_name, 'config.yml').items():
+        if category in config:
+            if isinstance(config.get(category), collections.abc.MutableMapping):
+                config[category].update(details)
+        else:
+            config[category] = details
+    return config
+
+
+# registry package logs to a file under /var/log,
+# tests import it with the service config and a plain logger.
+registry = types.ModuleType('registry')
+registry.__path__ = [os.path.join(SERVICES_DIR, 'registry')]
+registry.service_name = 'registry'
+registry.config = _get_config(registry.service_name)
+registry.logger = logging.getLogger(registry.service_name)
+sys.modules['registry'] = registry
+
+
+@pytest.fixture
+def config():
+    """ Service config, to be changed with monkeypatch.setitem.
+    """
+    return registry.config
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    """ In memory redis, called with the redis-py 2 signatures the services are written for
+        i.e. zadd(name, score1, name1, ...) and zincrby(name, value, amount=1).
+    """
+    zadd, zincrby = core.SortedSetCommands.zadd, core.SortedSetCommands.zincrby
+
+    def zadd_pairs(self, name, *pairs):
+        return zadd(self, name, dict(zip(pairs[1::2], pairs[::2])))
+
+    def zincrby_value(self, name, value, amount=1):
+        return zincrby(self, name, amount, value)
+
+    monkeypatch.setattr(core.SortedSetCommands, 'zadd', zadd_pairs)
+    monkeypatch.setattr(core.SortedSetCommands, 'zincrby', zincrby_value)
+
+    return fakeredis.FakeStrictRedis(decode_responses=True)
+
+
+@pytest.fixture
+def cache(redis_client):
+    """ Registry cache wrapper without local cache (entries expire right away).
+    """
+    from registry._impl import cache as _cache, local_cache, scripts
+
+    return _cache.RegistryCacheWrapper(
+        redis_client,
+        scripts.Scripts(redis_client),
+        local_cache.LocalCache(100, 0),
+        {},
+    )
+
+
+@pytest.fixture
+def db():
+    """ Registry db wrapper on an in memory sqlite db.
+    """
+    from registry._impl import db as _db, models
+
+    engine = sqlalchemy.create_engine('sqlite://')
+    models.DeclarativeBase.metadata.create_all(engine)
+    session = orm.Session(bind=engine)
+
+    yield _db.RegistryDatabaseSessionWrapper(session)
+
+    session.close()
+    engine.dispose()
+
+
+@pytest.fixture
+def service(db, cache):
+    """ Registry service worker using the db and cache fixtures, other dependencies are mocked.
+    """
+    from nameko.testing.services import worker_factory
+    from registry._impl import service as _service
+
+    return worker_factory(_service.RegistryService, db=db, cache=cache)
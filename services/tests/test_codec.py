@@ -0,0 +1,92 @@
+""" Tests of the encoding of the repository entries in cache.
+"""
+
+import pytest
+
+from registry._impl import codec
+
+
+REPO = {
+    'name': 'usd_dev',
+    'description': 'USD in Docker.',
+    'uri': 'usd_dev.v1',
+    'tags': ['usd', 'docker usd', '"vfx pipeline"'],
+    'downloads': 12,
+}
+
+LEGACY = {
+    'name': 'usd_dev',
+    'description': 'USD in Docker.',
+    'uri': 'usd_dev.v1',
+    'tags': str(['usd', 'docker usd', '"vfx pipeline"']),
+    'downloads': '12',
+}
+
+
+def test_v1_round_trip():
+    fields = codec.encode_repo(REPO)
+
+    assert fields['v'] == codec.VERSION
+    assert 'name' not in fields
+    assert not codec.is_legacy(fields)
+    assert codec.decode_repo('usd_dev', fields) == REPO
+
+
+def test_v1_round_trip_of_redis_strings():
+    # redis gives back strings, downloads included.
+    fields = {field: str(value) for field, value in codec.encode_repo(REPO).items()}
+
+    assert codec.decode_repo('usd_dev', fields) == REPO
+
+
+def test_v1_empty_fields():
+    fields = codec.encode_repo({'description': None, 'uri': None, 'tags': [], 'downloads': None})
+
+    assert codec.decode_repo('empty', fields) == {
+        'name': 'empty', 'description': '', 'uri': '', 'tags': [], 'downloads': 0
+    }
+
+
+def test_legacy_decode():
+    assert codec.is_legacy(LEGACY)
+    assert codec.decode_repo('usd_dev', LEGACY) == REPO
+
+
+def test_legacy_to_v1_round_trip():
+    details = codec.decode_repo('usd_dev', LEGACY)
+
+    assert codec.decode_repo('usd_dev', codec.encode_repo(details)) == details
+
+
+def test_downloads_override():
+    fields = codec.encode_repo(REPO)
+
+    assert codec.decode_repo('usd_dev', fields, 20)['downloads'] == 20
+    assert codec.decode_repo('usd_dev', LEGACY, 20)['downloads'] == 20
+
+
+@pytest.mark.parametrize('value, tags', [
+    ('[]', []),
+    ('["usd","maya"]', ['usd', 'maya']),
+    ("['usd', 'maya']", ['usd', 'maya']),
+    ('[\'it\\\'s\']', ["it's"]),
+])
+def test_decode_tags(value, tags):
+    assert codec.decode_tags(value) == tags
+
+
+def test_decode_tags_does_not_eval():
+    with pytest.raises(ValueError):
+        codec.decode_tags("__import__('os').getcwd()")
+
+
+def test_migrate_legacy_entries(cache, redis_client):
+    redis_client.hset('{}:usd_dev'.format(cache.repos_key), mapping=LEGACY)
+    redis_client.hset('{}:maya_dev'.format(cache.repos_key), mapping=codec.encode_repo(dict(REPO, name='maya_dev')))
+
+    assert cache.migrate_repos() == 1
+    assert cache.migrate_repos() == 0
+
+    fields = redis_client.hgetall('{}:usd_dev'.format(cache.repos_key))
+    assert set(fields) == {'v', 'd', 'u', 't', 'n'}
+    assert cache.get_repo_details('usd_dev') == REPO
@@ -0,0 +1,43 @@
+""" Tests of the downloads counted in cache and flushed to db (DOWNLOADS.MODE 'buffered').
+"""
+
+import pytest
+
+
+@pytest.fixture
+def repo(db, config, monkeypatch):
+    monkeypatch.setitem(config['DOWNLOADS'], 'MODE', 'buffered')
+    db.add_tags(['usd'])
+    db.add_repos([{'name': 'usd_dev', 'description': 'USD in Docker.', 'uri': 'usd_dev.v1', 'tags': ['usd']}])
+    return 'usd_dev'
+
+
+def cached_downloads(service, repo):
+    return {
+        'get_repo': service.get_repo(repo)['downloads'],
+        'get_repos': service.get_repos(['usd'])[0]['downloads'],
+        'get_repos_by_name': service.get_repos_by_name([repo])['repos'][0]['downloads'],
+    }
+
+
+def test_fill_keeps_downloads_not_flushed(service, db, repo):
+    # click -> fill -> click -> flush
+    assert [service.update_downloads(repo) for _ in range(3)] == [1, 2, 3]
+    assert service.get_repos(['usd'])[0]['downloads'] == 3
+
+    assert service.update_downloads(repo) == 4
+    service.flush_downloads()
+
+    assert db.get_repo_details(repo)['downloads'] == 4
+    assert cached_downloads(service, repo) == {'get_repo': 4, 'get_repos': 4, 'get_repos_by_name': 4}
+
+
+def test_fill_never_lowers_cached_downloads(service, cache, db, repo):
+    service.get_repos(['usd'])
+    cache.set_downloads({repo: 10})
+
+    # db lags behind the cache, e.g. its update is not applied yet.
+    cache.update_repos([db.get_repo_details(repo)])
+    cache.add_repos(['usd'], [db.get_repo_details(repo)])
+
+    assert cached_downloads(service, repo) == {'get_repo': 10, 'get_repos': 10, 'get_repos_by_name': 10}
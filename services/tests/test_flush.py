@@ -0,0 +1,87 @@
+""" Tests of the increments buffered in cache and flushed to db by batches.
+"""
+
+import pytest
+
+
+@pytest.fixture
+def tags(db):
+    db.add_tags(['usd', 'maya'])
+    return ['usd', 'maya']
+
+
+def popularity(db):
+    return {tag.name: tag.popularity for tag in db.get_tags()}
+
+
+def test_pending_increments_are_batched_until_acknowledged(cache):
+    assert cache.buffer_popularity(['usd', 'usd', 'maya']) == 3
+    assert cache.pending_count('popularity') == 3
+
+    batch_id, counts = cache.pop_batch('popularity')
+    assert counts == {'usd': 2, 'maya': 1}
+    assert cache.pending_count('popularity') == 0
+
+    # increments buffered meanwhile wait for the next batch.
+    cache.buffer_popularity(['nuke'])
+    assert cache.pop_batch('popularity') == (batch_id, counts)
+
+    assert cache.ack_batch('popularity', batch_id)
+    assert not cache.ack_batch('popularity', batch_id)
+
+    next_batch_id, counts = cache.pop_batch('popularity')
+    assert next_batch_id != batch_id
+    assert counts == {'nuke': 1}
+
+
+def test_nothing_pending(cache):
+    assert cache.pop_batch('popularity') == (None, {})
+
+
+def test_replayed_batch_is_applied_once(db, tags):
+    assert db.apply_popularity('batch', {'usd': 2, 'maya': 1})
+    assert not db.apply_popularity('batch', {'usd': 2, 'maya': 1})
+
+    assert popularity(db) == {'usd': 3, 'maya': 2}
+
+
+def test_flush(service, cache, db, tags):
+    cache.buffer_popularity(['usd', 'usd', 'maya'])
+
+    service.flush_popularity()
+
+    assert popularity(db) == {'usd': 3, 'maya': 2}
+    assert cache.pop_batch('popularity') == (None, {})
+
+
+def test_flush_failing_before_ack_is_replayed_once(service, cache, db, tags, monkeypatch):
+    cache.buffer_popularity(['usd', 'usd', 'maya'])
+
+    def ack_batch(kind, batch_id):
+        raise ConnectionError('cache is gone')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(cache, 'ack_batch', ack_batch)
+        with pytest.raises(ConnectionError):
+            service.flush_popularity()
+
+    # the batch applied to db is handed out again, then acknowledged without applying it twice.
+    service.flush_popularity()
+
+    assert popularity(db) == {'usd': 3, 'maya': 2}
+    assert cache.pop_batch('popularity') == (None, {})
+
+
+def test_flush_downloads(service, cache, db, config, monkeypatch):
+    monkeypatch.setitem(config['DOWNLOADS'], 'MODE', 'buffered')
+    db.add_tags(['usd'])
+    db.add_repos([{'name': 'usd_dev', 'description': '', 'uri': 'usd_dev.v1', 'tags': ['usd']}])
+
+    assert [service.update_downloads('usd_dev') for _ in range(3)] == [1, 2, 3]
+    assert db.get_repo_details('usd_dev')['downloads'] == 0
+
+    service.flush_downloads()
+    service.flush_downloads()
+
+    assert db.get_repo_details('usd_dev')['downloads'] == 3
+    assert service.update_downloads('usd_dev') == 4
@@ -0,0 +1,104 @@
+""" Tests of the in-process cache sitting in front of redis.
+"""
+
+import types
+
+import pytest
+
+from registry._impl import local_cache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = types.SimpleNamespace(now=100.0)
+    monkeypatch.setattr(local_cache, 'time', types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_get_missing():
+    cache = local_cache.LocalCache(2, 5)
+
+    assert cache.get('repo', 'usd_dev') is local_cache.MISSING
+    assert cache.stats() == {'hits': 0, 'misses': 1, 'evictions': 0, 'size': 0}
+
+
+def test_falsy_values_are_cached():
+    cache = local_cache.LocalCache(2, 5)
+    cache.set('repo', 'usd_dev', {})
+
+    assert cache.get('repo', 'usd_dev') == {}
+
+
+def test_least_recently_used_is_evicted(clock):
+    cache = local_cache.LocalCache(2, 5)
+    cache.set('repo', 'a', 1)
+    cache.set('repo', 'b', 2)
+
+    # a is used, b becomes the least recently used.
+    assert cache.get('repo', 'a') == 1
+    cache.set('repo', 'c', 3)
+
+    assert cache.get('repo', 'b') is local_cache.MISSING
+    assert cache.get('repo', 'a') == 1
+    assert cache.get('repo', 'c') == 3
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'evictions': 1, 'size': 2}
+
+
+def test_set_refreshes_recency(clock):
+    cache = local_cache.LocalCache(2, 5)
+    cache.set('repo', 'a', 1)
+    cache.set('repo', 'b', 2)
+    cache.set('repo', 'a', 10)
+    cache.set('repo', 'c', 3)
+
+    assert cache.get('repo', 'a') == 10
+    assert cache.get('repo', 'b') is local_cache.MISSING
+
+
+def test_entries_expire(clock):
+    cache = local_cache.LocalCache(2, 5)
+    cache.set('repo', 'a', 1)
+
+    clock.now += 5
+    assert cache.get('repo', 'a') == 1
+
+    clock.now += 0.1
+    assert cache.get('repo', 'a') is local_cache.MISSING
+    assert cache.stats()['size'] == 0
+
+
+def test_set_refreshes_time_to_live(clock):
+    cache = local_cache.LocalCache(2, 5)
+    cache.set('repo', 'a', 1)
+
+    clock.now += 4
+    cache.set('repo', 'a', 2)
+    clock.now += 4
+
+    assert cache.get('repo', 'a') == 2
+
+
+def test_zero_time_to_live_disables_the_cache(clock):
+    cache = local_cache.LocalCache(2, 0)
+    cache.set('repo', 'a', 1)
+
+    clock.now += 0.001
+    assert cache.get('repo', 'a') is local_cache.MISSING
+
+
+def test_invalidate():
+    cache = local_cache.LocalCache(10, 5)
+    cache.set('repo', 'a', 1)
+    cache.set('repo', 'b', 2)
+    cache.set('repos', ('usd',), 3)
+
+    cache.invalidate('repo', 'a')
+    assert cache.get('repo', 'a') is local_cache.MISSING
+    assert cache.get('repo', 'b') == 2
+
+    cache.invalidate('repo')
+    assert cache.get('repo', 'b') is local_cache.MISSING
+    assert cache.get('repos', ('usd',)) == 3
+
+    cache.clear()
+    assert cache.stats()['size'] == 0
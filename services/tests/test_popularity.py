@@ -0,0 +1,36 @@
+""" Tests of the tag popularity buffered in cache and flushed to db.
+"""
+
+import pytest
+
+
+@pytest.fixture
+def tags(db):
+    db.add_tags(['usd', 'maya'])
+    return ['usd', 'maya']
+
+
+def popularity(db):
+    return {tag.name: tag.popularity for tag in db.get_tags()}
+
+
+def test_reads_past_max_pending_do_not_flush(service, db, config, monkeypatch, tags):
+    monkeypatch.setitem(config['POPULARITY'], 'MAX_PENDING', 2)
+
+    service.get_repos(tags)
+    service.get_repos(tags)
+
+    assert popularity(db) == {'usd': 1, 'maya': 1}
+
+    service.check_popularity()
+
+    assert popularity(db) == {'usd': 3, 'maya': 3}
+
+
+def test_check_waits_for_max_pending(service, db, config, monkeypatch, tags):
+    monkeypatch.setitem(config['POPULARITY'], 'MAX_PENDING', 5)
+
+    service.get_repos(tags)
+    service.check_popularity()
+
+    assert popularity(db) == {'usd': 1, 'maya': 1}
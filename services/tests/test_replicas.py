@@ -0,0 +1,69 @@
+""" Tests of the reads routed to the replicas of the db.
+"""
+
+import sqlite3
+
+import pytest
+import sqlalchemy
+from sqlalchemy import orm
+
+from registry._impl import db as _db, models
+
+
+REPOS = [
+    {'name': 'repo{}'.format(i), 'description': '', 'uri': 'repo{}.v1'.format(i), 'tags': ['usd']}
+    for i in range(5)
+]
+
+
+def create_engine(path):
+    engine = sqlalchemy.create_engine('sqlite:///{}'.format(path))
+    models.DeclarativeBase.metadata.create_all(engine)
+
+    session = orm.Session(bind=engine)
+    wrapper = _db.RegistryDatabaseSessionWrapper(session)
+    wrapper.add_tags(['usd'])
+    wrapper.add_repos(REPOS)
+    session.close()
+
+    return engine
+
+
+@pytest.fixture
+def primary(tmp_path):
+    engine = create_engine(tmp_path / 'primary.db')
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def replica(tmp_path):
+    engine = create_engine(tmp_path / 'replica.db')
+    yield engine
+    engine.dispose()
+
+
+def fail_after(engine, statements):
+    """ Fail the statements of the engine past the given number.
+    """
+    executed = []
+
+    @sqlalchemy.event.listens_for(engine, 'before_cursor_execute')
+    def execute(*args):
+        executed.append(args)
+        if len(executed) > statements:
+            raise sqlite3.OperationalError('replica is gone')
+
+
+@pytest.mark.parametrize('limit', [None, 4])
+def test_replica_failing_mid_stream_falls_back_to_primary(primary, replica, limit):
+    router = _db.ReplicaRouter([replica], staleness=0, eject_for=60)
+    wrapper = _db.RegistryDatabaseSessionWrapper(orm.Session(bind=primary), router)
+
+    # page and tags of the first chunk are read from the replica, tags of the second one fail.
+    fail_after(replica, 2)
+    repos = list(wrapper.iter_repos_from_tags(limit=limit, chunk_size=2))
+
+    assert [repo['name'] for repo in repos] == [repo['name'] for repo in REPOS][::-1][:limit]
+    assert all(repo['tags'] == ['usd'] for repo in repos)
+    assert router.next_replica() is None